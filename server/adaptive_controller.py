@@ -0,0 +1,89 @@
+import threading
+from typing import Optional
+
+# ==============================================================================
+# --- ADAPTIVE FRAME-SKIP / DETECTION-SCALE CONTROLLER ---
+# ==============================================================================
+# Recognition workers report how long each processed frame took and how big
+# the smallest detected face was. Every ``window`` reports the controller
+# nudges the detection scale and frame skip towards ``target_latency``:
+#   too slow  -> lower the detection scale, then skip more frames
+#   headroom  -> skip fewer frames, then raise the detection scale
+# Faces smaller than ``min_face_px`` at detection scale raise the scale first,
+# since they cannot be encoded reliably.
+
+
+class AdaptiveController:
+    """ Tunes ``scale`` and ``frame_skip`` at runtime from measured processing time. Thread-safe. """
+
+    def __init__(self, target_latency: float = 0.15, scale: float = 0.25, min_scale: float = 0.2,
+                 max_scale: float = 0.5, scale_step: float = 0.05, frame_skip: int = 2, min_skip: int = 1,
+                 max_skip: int = 8, min_face_px: int = 50, window: int = 10, hysteresis: float = 0.2,
+                 smoothing: float = 0.2):
+        self.target_latency = target_latency
+        self.scale = scale
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.scale_step = scale_step
+        self.frame_skip = frame_skip
+        self.min_skip = min_skip
+        self.max_skip = max_skip
+        self.min_face_px = min_face_px
+        self.window = window
+        self.hysteresis = hysteresis
+        self.smoothing = smoothing
+
+        self.latency: Optional[float] = None
+        self.stage_latency = {}
+        self.small_faces = 0
+        self.samples = 0
+        self.lock = threading.Lock()
+
+    def record(self, stage_times: dict, smallest_face_px: Optional[int] = None) -> None:
+        """
+        Reports one processed frame: ``stage_times`` maps a stage name (e.g.
+        "detect", "encode") to seconds, ``smallest_face_px`` is the height of the
+        smallest face at detection scale (None when no face was found).
+        """
+        total = sum(stage_times.values())
+        with self.lock:
+            self.latency = total if self.latency is None else self.latency + self.smoothing * (total - self.latency)
+            for stage, seconds in stage_times.items():
+                previous = self.stage_latency.get(stage, seconds)
+                self.stage_latency[stage] = previous + self.smoothing * (seconds - previous)
+            if smallest_face_px is not None and smallest_face_px < self.min_face_px:
+                self.small_faces += 1
+            self.samples += 1
+            if self.samples >= self.window:
+                self._adjust()
+
+    def _adjust(self) -> None:
+        too_slow = self.latency > self.target_latency * (1 + self.hysteresis)
+        headroom = self.latency < self.target_latency * (1 - self.hysteresis)
+        faces_too_small = self.small_faces * 2 >= self.samples
+        self.samples = self.small_faces = 0
+
+        if faces_too_small and self.scale < self.max_scale:
+            self._set_scale(self.scale + self.scale_step)
+            if too_slow and self.frame_skip < self.max_skip:
+                self.frame_skip += 1
+        elif too_slow:
+            if self.scale > self.min_scale and not faces_too_small:
+                self._set_scale(self.scale - self.scale_step)
+            elif self.frame_skip < self.max_skip:
+                self.frame_skip += 1
+        elif headroom:
+            if self.frame_skip > self.min_skip:
+                self.frame_skip -= 1
+            elif self.scale < self.max_scale:
+                self._set_scale(self.scale + self.scale_step)
+
+    def _set_scale(self, scale: float) -> None:
+        self.scale = round(min(self.max_scale, max(self.min_scale, scale)), 3)
+        # Latency measured at the old scale no longer applies
+        self.latency = None
+
+    def stats(self) -> str:
+        with self.lock:
+            stages = " ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in self.stage_latency.items())
+            return f"scale={self.scale:.2f} skip={self.frame_skip} {stages}"
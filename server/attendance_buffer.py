@@ -0,0 +1,98 @@
+import asyncio
+from typing import Callable, Optional
+
+
+class BufferFullError(Exception):
+    """ Raised when the write-behind buffer stays full for longer than the backpressure timeout. """
+
+
+class WriteBehindBuffer:
+    """
+    Bounded in-process buffer of attendance documents that are acknowledged
+    before they reach Firestore. A background task hands them to ``writer``
+    (a blocking ``dict[doc_id, data] -> None`` function, run in a worker thread)
+    every ``flush_interval`` seconds or as soon as ``max_batch`` are queued.
+    ``drain()`` flushes everything left on shutdown, for at most ``drain_timeout``
+    seconds, and returns whatever could not be written in that time.
+    """
+
+    def __init__(self, writer: Callable[[dict], None], max_batch: int = 500, flush_interval: float = 0.2,
+                 capacity: int = 5000, put_timeout: float = 1.0, retry_delay: float = 1.0, drain_timeout: float = 10.0):
+        self.writer = writer
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.capacity = capacity
+        self.put_timeout = put_timeout
+        self.retry_delay = retry_delay
+        self.drain_timeout = drain_timeout
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self.flushing: dict = {}  # batch taken off the queue and not written yet
+        self.closing = False
+
+    def start(self) -> None:
+        self.queue = asyncio.Queue(maxsize=self.capacity)
+        self.task = asyncio.create_task(self._run())
+
+    async def put(self, doc_id: str, data: dict) -> None:
+        """ Queues one document, waiting up to ``put_timeout`` for space (backpressure). """
+        if self.closing or self.queue is None:
+            raise BufferFullError("write-behind buffer is not accepting attendances")
+        try:
+            await asyncio.wait_for(self.queue.put((doc_id, data)), timeout=self.put_timeout)
+        except asyncio.TimeoutError:
+            raise BufferFullError("write-behind buffer is full")
+
+    async def drain(self) -> dict:
+        """
+        Stops accepting new documents and waits up to ``drain_timeout`` until
+        every queued one has been written. Returns the documents still unwritten
+        (empty if the flush completed); those in the interrupted batch may have
+        reached Firestore anyway.
+        """
+        self.closing = True
+        if self.queue is None:
+            return {}
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=self.drain_timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.task.cancel()
+
+        unflushed = dict(self.flushing)
+        while not self.queue.empty():
+            doc_id, data = self.queue.get_nowait()
+            unflushed.setdefault(doc_id, data)
+        return unflushed
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = dict([await self.queue.get()])
+            # Taken off the queue, so drain() must find these here until they are written
+            self.flushing = batch
+            taken = 1
+            deadline = loop.time() + self.flush_interval
+            while taken < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    doc_id, data = await asyncio.wait_for(self.queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    break
+                taken += 1
+                batch.setdefault(doc_id, data)
+
+            # Keep retrying: these check-ins were already acknowledged to the kiosks
+            while True:
+                try:
+                    await asyncio.to_thread(self.writer, batch)
+                    break
+                except Exception as e:
+                    print(f"Write-behind flush of {len(batch)} attendances failed, retrying: {e}")
+                    await asyncio.sleep(self.retry_delay)
+            self.flushing = {}
+
+            for _ in range(taken):
+                self.queue.task_done()
@@ -0,0 +1,69 @@
+import threading
+from datetime import date
+from typing import Callable, Dict, Optional
+
+
+class DailyAttendanceLog:
+    """
+    In-process ``{day: {attendee_id: timestamp}}`` map of check-ins already
+    recorded, used to reject duplicates without querying Firestore. A day is
+    seeded through ``loader`` the first time it is touched; the loader runs
+    outside the lock, so a slow query only holds up callers of that same day.
+    Only the most recent ``keep_days`` days are kept in memory.
+    """
+
+    def __init__(self, loader: Optional[Callable[[date], Dict[str, int]]] = None, keep_days: int = 7):
+        self.loader = loader
+        self.keep_days = keep_days
+        self.days: Dict[date, Dict[str, int]] = {}
+        self.lock = threading.Lock()
+
+    def _load(self, day: date) -> None:
+        """ Seeds ``day`` through ``loader`` if it is not in memory yet; the query runs outside the lock. """
+        with self.lock:
+            if day in self.days or self.loader is None:
+                return
+        loaded = self.loader(day)
+        with self.lock:
+            # Another thread may have seeded the day, or added to it, meanwhile
+            attendees = self._day(day)
+            for attendee_id, timestamp in loaded.items():
+                attendees.setdefault(attendee_id, timestamp)
+
+    def _day(self, day: date) -> Dict[str, int]:
+        # Caller holds the lock
+        attendees = self.days.get(day)
+        if attendees is None:
+            attendees = self.days[day] = {}
+            for old_day in sorted(self.days)[:-self.keep_days]:
+                del self.days[old_day]
+        return attendees
+
+    def seen(self, attendee_id: str, day: date) -> bool:
+        self._load(day)
+        with self.lock:
+            return attendee_id in self._day(day)
+
+    def timestamp(self, attendee_id: str, day: date) -> Optional[int]:
+        """ Returns when the student checked in on ``day``, or None. """
+        self._load(day)
+        with self.lock:
+            return self._day(day).get(attendee_id)
+
+    def add(self, attendee_id: str, day: date, timestamp: int) -> None:
+        self._load(day)
+        with self.lock:
+            self._day(day).setdefault(attendee_id, timestamp)
+
+    def discard(self, attendee_id: str, day: date) -> None:
+        """ Drops one remembered check-in, e.g. one that could not be recorded after all. """
+        with self.lock:
+            attendees = self.days.get(day)
+            if attendees is not None:
+                attendees.pop(attendee_id, None)
+
+    def forget(self, attendee_id: str) -> None:
+        """ Drops every remembered check-in of a student, e.g. after they were removed. """
+        with self.lock:
+            for attendees in self.days.values():
+                attendees.pop(attendee_id, None)
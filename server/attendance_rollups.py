@@ -0,0 +1,159 @@
+import random
+import threading
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+from firebase_admin import firestore
+from google.cloud.firestore_v1 import FieldFilter
+
+# Each UTC day has a base rollup document (``YYYYMMDD``) written by a full
+# recount, plus ``ROLLUP_SHARDS`` shard documents (``YYYYMMDD_<n>``) that
+# receive the check-ins counted since, per 15-minute bucket. Check-ins are
+# counted in memory and flushed to a random shard about once a second, apart
+# from the attendance writes, so a busy day never hammers one document and a
+# failing rollup write can never reject a check-in. Days without a complete
+# base document (e.g. recorded before rollups existed) are recounted on first read.
+
+ROLLUP_COLLECTION = "attendance_rollups"
+ROLLUP_SHARDS = 10
+BUCKET_SECONDS = 15 * 60
+BUCKETS_PER_DAY = 24 * 60 * 60 // BUCKET_SECONDS
+
+
+def start_of_day(day: date) -> int:
+    return int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp())
+
+
+def rollup_doc_id(day: date) -> str:
+    return day.strftime("%Y%m%d")
+
+
+def shard_doc_ids(day: date) -> list[str]:
+    return [f"{rollup_doc_id(day)}_{shard}" for shard in range(ROLLUP_SHARDS)]
+
+
+class RollupCounter:
+    """
+    Counts check-ins per day and bucket in memory and adds them to a random
+    shard of each day's rollup every ``interval`` seconds from a daemon
+    thread. Counts of a failed flush are kept for the next one. Thread-safe.
+    """
+
+    def __init__(self, db, interval: float = 1.0):
+        self.db = db
+        self.interval = interval
+        self.pending: dict[date, Counter] = defaultdict(Counter)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def add(self, timestamps: Iterable[int], step: int = 1) -> None:
+        with self.lock:
+            for timestamp in timestamps:
+                day = datetime.fromtimestamp(timestamp, tz=timezone.utc).date()
+                self.pending[day][str((timestamp - start_of_day(day)) // BUCKET_SECONDS)] += step
+
+    def start(self) -> None:
+        def run():
+            while not self.stop_event.wait(self.interval):
+                self.flush()
+
+        self.thread = threading.Thread(target=run, name="rollup-counter", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """ Stops the background thread and makes one last flush attempt. """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.interval * 2)
+        self.flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            pending, self.pending = self.pending, defaultdict(Counter)
+        pending = {day: counter for day, counter in pending.items() if any(counter.values())}
+        if not pending:
+            return
+
+        batch = self.db.batch()
+        for day, counter in pending.items():
+            shard = self.db.collection(ROLLUP_COLLECTION).document(random.choice(shard_doc_ids(day)))
+            batch.set(shard, {
+                "total": firestore.Increment(sum(counter.values())),
+                "buckets": {bucket: firestore.Increment(count) for bucket, count in counter.items() if count},
+            }, merge=True)
+        try:
+            batch.commit()
+        except Exception as e:
+            print(f"Rollups: flush failed, retrying with the next one: {e}")
+            with self.lock:
+                for day, counter in pending.items():
+                    self.pending[day].update(counter)
+
+
+def _add_counts(rollup: dict, data: dict) -> None:
+    rollup["total"] += data.get("total", 0)
+    for bucket, count in data.get("buckets", {}).items():
+        rollup["buckets"][bucket] = rollup["buckets"].get(bucket, 0) + count
+
+
+@firestore.transactional
+def _backfill(transaction, db, day: date) -> dict:
+    collection = db.collection(ROLLUP_COLLECTION)
+    base_ref = collection.document(rollup_doc_id(day))
+    snapshot = base_ref.get(transaction=transaction)
+    if snapshot.exists and (snapshot.to_dict() or {}).get("complete"):
+        return None
+    shard_refs = [collection.document(doc_id) for doc_id in shard_doc_ids(day)]
+    # Read so that a shard flushed meanwhile makes the transaction retry
+    list(transaction.get_all(shard_refs))
+
+    # Recount the whole day from the raw attendances; the shards' counts are
+    # covered by the recount, so they are folded into the base document
+    start = start_of_day(day)
+    docs = db.collection("attendances") \
+        .where(filter=FieldFilter("timestamp", ">=", start)) \
+        .where(filter=FieldFilter("timestamp", "<", start + 24 * 60 * 60)) \
+        .select(["timestamp"]) \
+        .stream(transaction=transaction)
+    counter = Counter(str((doc.to_dict()["timestamp"] - start) // BUCKET_SECONDS) for doc in docs)
+    data = {"complete": True, "total": sum(counter.values()), "buckets": dict(counter)}
+    transaction.set(base_ref, data)
+    for shard_ref in shard_refs:
+        transaction.delete(shard_ref)
+    return data
+
+
+def load_rollups(db, days: list[date]) -> dict[date, dict]:
+    """ Returns each day's ``{"total", "buckets"}`` (base plus shards), recounting days without a complete base. """
+    collection = db.collection(ROLLUP_COLLECTION)
+    doc_ids = [doc_id for day in days for doc_id in [rollup_doc_id(day)] + shard_doc_ids(day)]
+    snapshots = {
+        snapshot.id: snapshot.to_dict() or {}
+        for snapshot in db.get_all([collection.document(doc_id) for doc_id in doc_ids]) if snapshot.exists
+    }
+
+    rollups = {}
+    today = datetime.now(tz=timezone.utc).date()
+    for day in days:
+        rollup = {"total": 0, "buckets": {}}
+        rollups[day] = rollup
+        if day > today:
+            continue
+        base = snapshots.get(rollup_doc_id(day))
+        if base is None or not base.get("complete"):
+            recounted = _backfill(db.transaction(), db, day)
+            if recounted is not None:
+                _add_counts(rollup, recounted)
+                continue
+        else:
+            _add_counts(rollup, base)
+        for doc_id in shard_doc_ids(day):
+            _add_counts(rollup, snapshots.get(doc_id, {}))
+    return rollups
+
+
+def week_days(now: datetime) -> list[date]:
+    monday = (now - timedelta(days=now.weekday())).date()
+    return [monday + timedelta(days=offset) for offset in range(7)]
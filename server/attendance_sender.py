@@ -0,0 +1,185 @@
+import queue
+import threading
+import time
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from attendance_spool import AttendanceSpool
+
+# ==============================================================================
+# --- BACKGROUND ATTENDANCE SENDER ---
+# ==============================================================================
+# The video loop only enqueues recognized students; a daemon thread posts them
+# over one keep-alive session and hands the outcome back through ``poll()``.
+# With a spool attached, check-ins are made durable before posting and the ones
+# that could not be delivered are replayed with their original timestamps.
+
+STATUS_PENDING = "PENDING"
+STATUS_SUCCESS = "SUCCESS"
+STATUS_ALREADY_ATTENDED = "ALREADY_ATTENDED"
+STATUS_NETWORK_ERROR = "NETWORK_ERROR"
+STATUS_SAVED_OFFLINE = "SAVED_OFFLINE"
+STATUS_REJECTED = "REJECTED"
+
+
+def _utc_day(timestamp: int) -> date:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).date()
+
+
+class AttendanceSender:
+    """ Posts check-ins from a background thread so the camera loop never blocks on HTTP. """
+
+    def __init__(self, endpoint: str, timeout: float = 5, max_queued: int = 256,
+                 spool: Optional[AttendanceSpool] = None, retry_interval: float = 30,
+                 batch_endpoint: Optional[str] = None, batch_size: int = 500):
+        self.endpoint = endpoint
+        self.batch_endpoint = batch_endpoint
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.spool = spool
+        self.retry_interval = retry_interval
+        self.last_replay = 0.0
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+
+        self.outbox: "queue.Queue[Optional[Tuple[str, int]]]" = queue.Queue(maxsize=max_queued)
+        self.results: "queue.Queue[Tuple[str, str]]" = queue.Queue()
+        # Keyed by UTC day like the server's dedupe; only the current day is kept
+        self.sent: Dict[date, Set[str]] = {}
+        self.pending: Set[Tuple[str, date]] = set()
+        self.lock = threading.Lock()
+
+        self.thread = threading.Thread(target=self._run, name="attendance-sender", daemon=True)
+        self.thread.start()
+
+    def submit(self, attendee_id: str) -> str:
+        """
+        Queues a check-in stamped with the current time. Returns ``ALREADY_ATTENDED``
+        for students confirmed earlier the same UTC day, otherwise ``PENDING`` (or
+        ``NETWORK_ERROR`` if the queue is full); the final outcome is reported by ``poll()``.
+        """
+        timestamp = int(time.time())
+        day = _utc_day(timestamp)
+        with self.lock:
+            if day not in self.sent:
+                # New day: yesterday's confirmations no longer apply
+                self.sent = {day: set()}
+            if attendee_id in self.sent[day]:
+                return STATUS_ALREADY_ATTENDED
+            if (attendee_id, day) in self.pending:
+                return STATUS_PENDING
+            self.pending.add((attendee_id, day))
+        try:
+            self.outbox.put_nowait((attendee_id, timestamp))
+        except queue.Full:
+            with self.lock:
+                self.pending.discard((attendee_id, day))
+            print(f"[ERROR] Attendance queue full, dropping check-in for {attendee_id}")
+            return STATUS_NETWORK_ERROR
+        return STATUS_PENDING
+
+    def poll(self) -> List[Tuple[str, str]]:
+        """ Returns the ``(attendee_id, status)`` outcomes received since the last call. """
+        outcomes = []
+        while True:
+            try:
+                outcomes.append(self.results.get_nowait())
+            except queue.Empty:
+                return outcomes
+
+    def close(self, timeout: float = 5) -> None:
+        """ Stops the sender after the already queued check-ins have been posted. """
+        self.outbox.put(None)
+        self.thread.join(timeout)
+        self.session.close()
+        if self.spool is not None:
+            self.spool.close()
+
+    def _run(self) -> None:
+        # Flush whatever a previous run left in the spool before taking new check-ins
+        self._maybe_replay()
+        while True:
+            try:
+                item = self.outbox.get(timeout=self.retry_interval)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                return
+            if item:
+                self._deliver(*item)
+            self._maybe_replay()
+
+    def _deliver(self, attendee_id: str, timestamp: int) -> None:
+        day = _utc_day(timestamp)
+        if self.spool is not None:
+            timestamp = self.spool.add(attendee_id, timestamp)
+        result = self._post(attendee_id, timestamp)
+        if self.spool is not None:
+            if result == STATUS_NETWORK_ERROR:
+                result = STATUS_SAVED_OFFLINE
+                # Replay only after a full retry interval instead of hammering a server that is down
+                self.last_replay = time.time()
+            else:
+                self.spool.remove(attendee_id, timestamp)
+        with self.lock:
+            self.pending.discard((attendee_id, day))
+            if result != STATUS_NETWORK_ERROR and day in self.sent:
+                self.sent[day].add(attendee_id)
+        self.results.put((attendee_id, result))
+
+    def _maybe_replay(self) -> None:
+        """ Re-posts spooled check-ins in one pass, stopping at the first delivery failure. """
+        if self.spool is None or time.time() - self.last_replay < self.retry_interval:
+            return
+        self.last_replay = time.time()
+        spooled = self.spool.pending(self.batch_size)
+        if not spooled:
+            return
+        print(f"[INFO] Replaying {len(spooled)} offline check-ins...")
+        if self.batch_endpoint is not None:
+            self._replay_batches(spooled)
+            return
+        for attendee_id, timestamp in spooled:
+            if self._post(attendee_id, timestamp) == STATUS_NETWORK_ERROR:
+                print("[INFO] Server still unreachable, keeping the remaining check-ins spooled")
+                return
+            self.spool.remove(attendee_id, timestamp)
+
+    def _replay_batches(self, spooled: List[Tuple[str, int]]) -> None:
+        """ Replays the spool through the batch endpoint, one request per ``batch_size`` check-ins. """
+        while spooled:
+            payload = [{"attendee_id": attendee_id, "timestamp": timestamp} for attendee_id, timestamp in spooled]
+            try:
+                response = self.session.post(self.batch_endpoint, json=payload, timeout=self.timeout * 2)
+                response.raise_for_status()
+            except requests.exceptions.RequestException as req_err:
+                print(f"[INFO] Batch replay failed, keeping check-ins spooled: {req_err}")
+                return
+            # Every per-item status (created, already_attended, invalid) is final
+            for attendee_id, timestamp in spooled:
+                self.spool.remove(attendee_id, timestamp)
+            print(f"[SUCCESS] Replayed {len(spooled)} offline check-ins")
+            spooled = self.spool.pending(self.batch_size)
+
+    def _post(self, attendee_id: str, timestamp: int) -> str:
+        payload = {"attendee_id": attendee_id, "timestamp": timestamp}
+        try:
+            response = self.session.post(self.endpoint, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            print(f"[SUCCESS] Attendance recorded for {attendee_id} at {time.strftime('%H:%M:%S')}")
+            return STATUS_SUCCESS
+        except requests.exceptions.HTTPError as http_err:
+            if http_err.response.status_code == 400:
+                print(f"[WARNING] Already recorded today for {attendee_id}")
+                return STATUS_ALREADY_ATTENDED
+            print(f"[ERROR] HTTP error: {http_err}")
+            if http_err.response.status_code < 500:
+                return STATUS_REJECTED
+            return STATUS_NETWORK_ERROR
+        except requests.exceptions.RequestException as req_err:
+            print(f"[ERROR] Network error: {req_err}")
+            return STATUS_NETWORK_ERROR
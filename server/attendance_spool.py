@@ -0,0 +1,69 @@
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import List, Tuple
+
+# ==============================================================================
+# --- DURABLE OFFLINE ATTENDANCE SPOOL ---
+# ==============================================================================
+# Every check-in is written here before it is posted and removed once the
+# server has answered, so nothing recognized while the network is down is lost.
+# Rows are unique per attendee and UTC day, matching the server's daily dedupe.
+
+
+def _utc_day(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime("%Y-%m-%d")
+
+
+class AttendanceSpool:
+    """ SQLite-backed outbox of check-ins that have not been acknowledged by the server yet. """
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            " attendee_id TEXT NOT NULL,"
+            " day TEXT NOT NULL,"
+            " timestamp INTEGER NOT NULL,"
+            " PRIMARY KEY (attendee_id, day))"
+        )
+        self.conn.commit()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    def add(self, attendee_id: str, timestamp: int) -> int:
+        """
+        Stores a check-in and returns the timestamp spooled for that student and
+        day, which is the original one if an earlier check-in is still pending.
+        """
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO spool (attendee_id, day, timestamp) VALUES (?, ?, ?)",
+                (attendee_id, _utc_day(timestamp), timestamp),
+            )
+            return self.conn.execute(
+                "SELECT timestamp FROM spool WHERE attendee_id = ? AND day = ?", (attendee_id, _utc_day(timestamp))
+            ).fetchone()[0]
+
+    def pending(self, limit: int = 500) -> List[Tuple[str, int]]:
+        """ Returns the oldest spooled ``(attendee_id, timestamp)`` pairs. """
+        with self.lock:
+            return self.conn.execute(
+                "SELECT attendee_id, timestamp FROM spool ORDER BY timestamp LIMIT ?", (limit,)
+            ).fetchall()
+
+    def remove(self, attendee_id: str, timestamp: int) -> None:
+        """ Drops a check-in once the server has acknowledged it. """
+        with self.lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM spool WHERE attendee_id = ? AND day = ?", (attendee_id, _utc_day(timestamp))
+            )
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
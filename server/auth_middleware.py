@@ -1,12 +1,19 @@
+import hmac
 import os
+import threading
+import time
+from collections import OrderedDict
 from typing import Iterable, Optional
 
 from dotenv import load_dotenv
 import jwt
-from fastapi import HTTPException, status, Request, Response
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
 from firebase_admin import auth
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.types import ASGIApp
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.routing import compile_path
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 load_dotenv(".env.local")
 
@@ -17,31 +24,147 @@ JWT_ALGORITHM = "HS256"
 
 EXEMPT_ROUTES: dict[str, set[str] | None] = {
     "/attendances/": None,
+    "/attendances/batch/": None,
     "/students/": {"GET", "POST"},
     "/instructors/": None,
     "/insights/": None,
+    "/faces/{filename}": {"GET"},
+    "/faces/thumbs/{filename}": {"GET"},
     "/docs": None,
     "/openapi.json": None,
     "/redoc": None,
 }
 
-class AuthMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app: ASGIApp, exempt_paths: dict[str, set[str] | None] = None):
-        super().__init__(app)
+# Recognition devices (kiosks) authenticate with a device key in the
+# X-Device-Key header instead of an instructor account. A device key only
+# opens the read-only routes below; every other route still needs an
+# instructor token. Comma-separated, so each kiosk can get its own key and
+# one can be revoked without re-keying the rest.
+DEVICE_KEY_HEADER = "X-Device-Key"
+DEVICE_API_KEYS = [key.strip() for key in os.getenv("DEVICE_API_KEYS", "").split(",") if key.strip()]
+
+DEVICE_ROUTES: dict[str, set[str]] = {
+    "/gallery/": {"GET"},
+    "/students/changes/": {"GET"},
+    # Maps a face to a student id, so it is not open to anonymous callers
+    "/recognitions/": {"POST"},
+}
+
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "300"))
+AUTH_CACHE_MAX_SIZE = int(os.getenv("AUTH_CACHE_MAX_SIZE", "1024"))
+
+class VerifiedUserCache:
+    """TTL + LRU cache of Firebase user records keyed by the JWT subject."""
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries: OrderedDict[str, tuple[float, str, auth.UserRecord]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, subject: str, email: str) -> Optional[auth.UserRecord]:
+        with self.lock:
+            entry = self.entries.get(subject)
+            if entry is None:
+                return None
+            expires_at, cached_email, user_record = entry
+            if expires_at < time.monotonic() or cached_email != email:
+                del self.entries[subject]
+                return None
+            self.entries.move_to_end(subject)
+            return user_record
+
+    def put(self, subject: str, email: str, user_record: auth.UserRecord) -> None:
+        with self.lock:
+            self.entries[subject] = (time.monotonic() + self.ttl, email, user_record)
+            self.entries.move_to_end(subject)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, uid: Optional[str] = None, email: Optional[str] = None) -> None:
+        """Drops every cached entry of a deleted or changed user."""
+        with self.lock:
+            stale = [
+                subject for subject, (_, cached_email, user_record) in self.entries.items()
+                if (uid is not None and user_record.uid == uid) or (email is not None and cached_email == email)
+            ]
+            for subject in stale:
+                del self.entries[subject]
+
+verified_users = VerifiedUserCache(AUTH_CACHE_TTL_SECONDS, AUTH_CACHE_MAX_SIZE)
+
+class AuthMiddleware:
+    """
+    Pure ASGI middleware that verifies the bearer token of every non-exempt
+    HTTP request. ``exempt_paths`` maps a path (which may contain path
+    parameters such as ``/students/{studentId}``) to the methods that skip
+    authentication, or to None to exempt every method. ``device_paths`` maps
+    the paths that also accept one of ``device_keys`` to their methods.
+    """
+
+    def __init__(self, app: ASGIApp, exempt_paths: dict[str, set[str] | None] = None,
+                 device_paths: dict[str, set[str]] = None, device_keys: list[str] = None):
+        self.app = app
         self.exempt_paths = exempt_paths or {}
+        self.device_paths = device_paths or {}
+        self.device_keys = [key.encode() for key in device_keys or []]
+        # Plain paths are looked up directly; templated ones are compiled once here
+        self.exempt_static = {path: methods for path, methods in self.exempt_paths.items() if "{" not in path}
+        self.exempt_patterns = [
+            (compile_path(path)[0], methods) for path, methods in self.exempt_paths.items() if "{" in path
+        ]
+
+    def is_exempt(self, path: str, method: str) -> bool:
+        if path in self.exempt_static:
+            allowed_methods = self.exempt_static[path]
+            return allowed_methods is None or method in allowed_methods
+        for pattern, allowed_methods in self.exempt_patterns:
+            if pattern.match(path):
+                return allowed_methods is None or method in allowed_methods
+        return False
+
+    def is_device(self, path: str, method: str, headers: Headers) -> bool:
+        if method not in self.device_paths.get(path, ()):
+            return False
+        key = headers.get(DEVICE_KEY_HEADER)
+        if key is None:
+            return False
+        # Compared with every key in constant time, so the timing reveals nothing about them
+        return any([hmac.compare_digest(key.encode(), device_key) for device_key in self.device_keys])
 
-    async def dispatch(self, request: Request, call_next) -> Response:
-        if request.method == "OPTIONS":
-            return await call_next(request)
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or self.is_exempt(scope["path"], scope["method"]):
+            await self.app(scope, receive, send)
+            return
 
-        path = request.url.path
-        allowed_methods = self.exempt_paths.get(path)
-        if allowed_methods is None and path in self.exempt_paths:
-            return await call_next(request)
-        if isinstance(allowed_methods, set) and request.method in allowed_methods:
-            return await call_next(request)
+        headers = Headers(scope=scope)
+        state = scope.setdefault("state", {})
+        if self.is_device(scope["path"], scope["method"], headers):
+            # Exposed to handlers as request.state.device
+            state["device"] = True
+            await self.app(scope, receive, send)
+            return
 
-        auth_header = request.headers.get("Authorization")
+        if DEVICE_KEY_HEADER in headers and "Authorization" not in headers:
+            detail = "Invalid device key" if scope["path"] in self.device_paths else "Device keys cannot access this route"
+            response = JSONResponse({"detail": detail}, status_code=status.HTTP_401_UNAUTHORIZED)
+            await response(scope, receive, send)
+            return
+
+        try:
+            payload, user_record = await self.authenticate(headers)
+        except HTTPException as exc:
+            response = JSONResponse({"detail": exc.detail}, status_code=exc.status_code)
+            await response(scope, receive, send)
+            return
+
+        # Exposed to handlers as request.state.user / request.state.token_payload
+        state["user"] = user_record
+        state["token_payload"] = payload
+        await self.app(scope, receive, send)
+
+    async def authenticate(self, headers: Headers) -> tuple[dict, auth.UserRecord]:
+        auth_header = headers.get("Authorization")
         if not auth_header or not auth_header.startswith("Bearer "):
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing or invalid authorization header")
 
@@ -61,14 +184,16 @@ class AuthMiddleware(BaseHTTPMiddleware):
         if not email:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token payload missing email")
 
-        try:
-            user_record = auth.get_user_by_email(email)
-        except auth.UserNotFoundError:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-        except Exception as exc:  # pragma: no cover - unexpected Firebase errors
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(exc))
-
-        request.state.user = user_record
-        request.state.token_payload = payload
+        subject = str(payload.get("sub", email))
+        user_record = verified_users.get(subject, email)
+        if user_record is None:
+            try:
+                # Network call to Firebase; keep it off the event loop
+                user_record = await run_in_threadpool(auth.get_user_by_email, email)
+            except auth.UserNotFoundError:
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+            except Exception as exc:  # pragma: no cover - unexpected Firebase errors
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(exc))
+            verified_users.put(subject, email, user_record)
 
-        return await call_next(request)
+        return payload, user_record
@@ -0,0 +1,158 @@
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+import face_recognition
+import numpy as np
+
+# ==============================================================================
+# --- PERSISTENT FACE ENCODING CACHE ---
+# ==============================================================================
+# Encodings are stored as one float32 matrix (``encodings.npy``) plus a small
+# JSON index that maps each student id to its row and to the size/mtime of the
+# image the row was computed from. Only new or changed images are re-encoded.
+
+ENCODING_DIM = 128
+CACHE_MATRIX_FILE = "encodings.npy"
+CACHE_INDEX_FILE = "encodings.json"
+NO_FACE_ROW = -1
+
+
+def _image_signature(image_path: str) -> List[int]:
+    """ Returns a cheap change signature (size, mtime in ns) for an image file. """
+    stat = os.stat(image_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class EncodingCache:
+    """ On-disk store of face encodings keyed by student id and image signature. """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.matrix_path = os.path.join(cache_dir, CACHE_MATRIX_FILE)
+        self.index_path = os.path.join(cache_dir, CACHE_INDEX_FILE)
+        self.index: Dict[str, dict] = {}
+        self.matrix = np.empty((0, ENCODING_DIM), dtype=np.float32)
+        self.dirty = False
+
+    def load(self) -> None:
+        """ Loads the cache from disk, starting empty if it is missing or corrupt. """
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            matrix = np.load(self.matrix_path)
+            if matrix.ndim != 2 or matrix.shape[1] != ENCODING_DIM or matrix.dtype != np.float32:
+                raise ValueError(f"unexpected matrix shape {matrix.shape}/{matrix.dtype}")
+            if any(entry["row"] >= len(matrix) for entry in index.values()):
+                raise ValueError("index refers to rows outside the matrix")
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"  - WARNING: Ignoring corrupt encoding cache in {self.cache_dir}: {e}")
+            return
+        self.index = index
+        self.matrix = matrix
+
+    def get(self, student_id: str, image_path: str) -> Tuple[bool, Optional[np.ndarray]]:
+        """
+        Returns ``(hit, encoding)``. ``hit`` is False when the image must be
+        (re-)encoded; ``encoding`` is None for images known to contain no face.
+        """
+        entry = self.index.get(student_id)
+        if entry is None:
+            return False, None
+        if entry["file"] != os.path.basename(image_path) or entry["signature"] != _image_signature(image_path):
+            return False, None
+        if entry["row"] == NO_FACE_ROW:
+            return True, None
+        return True, self.matrix[entry["row"]]
+
+    def put(self, student_id: str, image_path: str, encoding: Optional[np.ndarray]) -> None:
+        """ Records a freshly computed encoding (or None when no face was found). """
+        self.index[student_id] = {
+            "file": os.path.basename(image_path),
+            "signature": _image_signature(image_path),
+            "encoding": None if encoding is None else np.asarray(encoding, dtype=np.float32),
+        }
+        self.dirty = True
+
+    def save(self, student_ids: List[str]) -> None:
+        """
+        Rewrites the cache so it only holds ``student_ids``, compacting the
+        matrix. Files are replaced atomically so a crash never leaves a torn cache.
+        """
+        rows, index = [], {}
+        for student_id in student_ids:
+            entry = self.index.get(student_id)
+            if entry is None:
+                continue
+            if "encoding" in entry:
+                encoding = entry["encoding"]
+            elif entry["row"] == NO_FACE_ROW:
+                encoding = None
+            else:
+                encoding = self.matrix[entry["row"]]
+            row = NO_FACE_ROW
+            if encoding is not None:
+                row = len(rows)
+                rows.append(encoding)
+            index[student_id] = {"file": entry["file"], "signature": entry["signature"], "row": row}
+
+        if not self.dirty and index.keys() == self.index.keys():
+            return
+
+        matrix = np.array(rows, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_matrix_path = f"{self.matrix_path}.tmp"
+        tmp_index_path = f"{self.index_path}.tmp"
+        with open(tmp_matrix_path, "wb") as f:
+            np.save(f, matrix)
+        with open(tmp_index_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp_matrix_path, self.matrix_path)
+        os.replace(tmp_index_path, self.index_path)
+
+        self.index = index
+        self.matrix = matrix
+        self.dirty = False
+
+
+def load_known_faces(image_paths: Dict[str, str], cache_dir: str) -> Tuple[np.ndarray, List[str]]:
+    """
+    Returns ``(encodings, names)`` for the given ``{student_id: image_path}``
+    mapping, encoding only images that are missing from or changed in the cache.
+    """
+    cache = EncodingCache(cache_dir)
+    cache.load()
+
+    encodings, names = [], []
+    encoded_count = cached_count = 0
+    for student_id, img_path in image_paths.items():
+        try:
+            hit, encoding = cache.get(student_id, img_path)
+            if not hit:
+                image = face_recognition.load_image_file(img_path)
+                found = face_recognition.face_encodings(image)
+                encoding = found[0] if found else None
+                cache.put(student_id, img_path, encoding)
+                encoded_count += 1
+            else:
+                cached_count += 1
+        except Exception as e:
+            print(f"  - ERROR: Could not process {img_path}: {e}")
+            continue
+
+        if encoding is None:
+            if not hit:
+                print(f"  - WARNING: No face found in {img_path}")
+            continue
+        encodings.append(encoding)
+        names.append(student_id)
+
+    try:
+        cache.save(list(image_paths.keys()))
+    except OSError as e:
+        print(f"  - WARNING: Could not write encoding cache: {e}")
+
+    print(f"  - Encoded {encoded_count} new or changed images, reused {cached_count} from cache")
+    return np.array(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM), names
@@ -0,0 +1,97 @@
+import hashlib
+import io
+import os
+import threading
+from typing import BinaryIO, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# Uploaded photos are decoded, EXIF-rotated and cut down to a square crop
+# centered on the detected face, so every stored photo is a small JPEG of the
+# same shape no matter what the phone produced.
+
+MAX_DECODE_SIDE = 1600    # Larger uploads are downscaled before face detection
+CANONICAL_SIZE = 480      # Side of the stored, face-centered photo
+THUMBNAIL_SIZE = 96       # Side of the dashboard thumbnail
+FACE_CROP_SCALE = 2.2     # Crop side relative to the detected face
+JPEG_QUALITY = 90
+THUMBNAIL_QUALITY = 80
+
+Location = Tuple[int, int, int, int]  # (top, right, bottom, left)
+
+
+def load_enrollment_image(file: BinaryIO) -> np.ndarray:
+    """ Decodes an upload into an upright RGB array no larger than MAX_DECODE_SIDE. """
+    image = Image.open(file)
+    # Lets the JPEG decoder skip straight to a reduced scale for large photos
+    image.draft("RGB", (MAX_DECODE_SIDE, MAX_DECODE_SIDE))
+    image = ImageOps.exif_transpose(image).convert("RGB")
+    image.thumbnail((MAX_DECODE_SIDE, MAX_DECODE_SIDE), Image.LANCZOS)
+    return np.asarray(image)
+
+
+def crop_face(rgb_image: np.ndarray, location: Location) -> Image.Image:
+    """ Returns the square crop centered on the face, at most CANONICAL_SIZE wide (never upscaled). """
+    top, right, bottom, left = location
+    h, w = rgb_image.shape[:2]
+    side = int(min(max(bottom - top, right - left) * FACE_CROP_SCALE, h, w))
+    y0 = int(min(max((top + bottom) / 2 - side / 2, 0), h - side))
+    x0 = int(min(max((left + right) / 2 - side / 2, 0), w - side))
+    crop = Image.fromarray(rgb_image[y0:y0 + side, x0:x0 + side])
+    if side > CANONICAL_SIZE:
+        crop = crop.resize((CANONICAL_SIZE, CANONICAL_SIZE), Image.LANCZOS)
+    return crop
+
+
+def content_version(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def save_enrollment_image(image: Image.Image, faces_dir: str, student_id: str) -> tuple[str, str]:
+    """
+    Writes ``<student_id>.jpg`` and ``thumbs/<student_id>.jpg`` atomically and
+    returns the content versions (also their ETags) of the photo and of the thumbnail.
+    """
+    thumbs_dir = os.path.join(faces_dir, "thumbs")
+    os.makedirs(thumbs_dir, exist_ok=True)
+
+    photo = io.BytesIO()
+    image.save(photo, format="JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    thumbnail = image.copy()
+    thumbnail.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.LANCZOS)
+    thumb = io.BytesIO()
+    thumbnail.save(thumb, format="JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+
+    filename = f"{student_id}.jpg"
+    for directory, data in ((faces_dir, photo.getvalue()), (thumbs_dir, thumb.getvalue())):
+        path = os.path.join(directory, filename)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    # Drop photos of the same student stored under another extension by older versions
+    for existing in os.listdir(faces_dir):
+        if os.path.splitext(existing)[0] == student_id and existing != filename:
+            os.remove(os.path.join(faces_dir, existing))
+
+    return content_version(photo.getvalue()), content_version(thumb.getvalue())
+
+
+_etags: dict[str, tuple[tuple[int, int], str]] = {}
+_etags_lock = threading.Lock()
+
+
+def file_etag(path: str) -> str:
+    """ Strong ETag from the file's content hash, recomputed only when its size or mtime changes. """
+    stat = os.stat(path)
+    signature = (stat.st_size, stat.st_mtime_ns)
+    with _etags_lock:
+        cached = _etags.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    with open(path, "rb") as f:
+        etag = f'"{content_version(f.read())}"'
+    with _etags_lock:
+        _etags[path] = (signature, etag)
+    return etag
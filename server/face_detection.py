@@ -2,13 +2,19 @@
 # FINAL VERSION: Stable Face Recognition Client
 # ==============================================================================
 import cv2
-import face_recognition
 import os
 import time
 import requests
-import shutil
-from typing import Set, Dict
-from urllib.parse import urlparse
+from gallery import build_gallery
+from gallery_sync import DeviceKeyRejected, GallerySync
+from attendance_sender import AttendanceSender, STATUS_SUCCESS, STATUS_ALREADY_ATTENDED, STATUS_SAVED_OFFLINE
+from attendance_spool import AttendanceSpool
+from recognition_pipeline import CameraStream, MultiStreamPipeline
+from face_process_pool import FaceProcessPool
+from face_tracker import FaceTracker
+from motion_gate import MotionGate
+from adaptive_controller import AdaptiveController
+from face_quality import BestFrameSelector, score_face
 
 # ==============================================================================
 # --- CONFIGURATIONS ---
@@ -16,11 +22,17 @@ from urllib.parse import urlparse
 # **สำคัญ:** ตรวจสอบให้แน่ใจว่า IP นี้คือ IP ของ Notebook (Server) ของคุณ
 SERVER_API_BASE_URL = os.getenv("SERVER_API_BASE_URL", "http://localhost:8000") 
 FACE_DIR = os.getenv("FACE_DIR", "faces")
+ENCODING_CACHE_DIR = os.getenv("ENCODING_CACHE_DIR", "face_cache")
+ATTENDANCE_SPOOL_PATH = os.getenv("ATTENDANCE_SPOOL_PATH", "attendance_spool.sqlite3")
+# Device key the client downloads face encodings with: one of the server's DEVICE_API_KEYS
+SERVER_DEVICE_KEY = os.getenv("SERVER_DEVICE_KEY")
 if not (SERVER_API_BASE_URL and FACE_DIR):
     raise RuntimeWarning("environment variables not found")
+if not SERVER_DEVICE_KEY:
+    raise RuntimeError("SERVER_DEVICE_KEY environment variable must be set to one of the server's DEVICE_API_KEYS")
 
-STUDENTS_ENDPOINT = f"{SERVER_API_BASE_URL}/students/"
 ATTENDANCE_ENDPOINT = f"{SERVER_API_BASE_URL}/attendances/"
+ATTENDANCE_BATCH_ENDPOINT = f"{SERVER_API_BASE_URL}/attendances/batch/"
 
 # Directory to store face images
 os.makedirs(FACE_DIR, exist_ok=True)
@@ -29,12 +41,38 @@ os.makedirs(FACE_DIR, exist_ok=True)
 WINDOW_NAME = "Attendance Check-in System"
 
 # Face Recognition Settings
-FRAME_SKIP_RATE = 2  # ประมวลผลทุกๆ 2 เฟรม (ลดการใช้ CPU)
-RESIZE_FACTOR = 0.25 # ย่อขนาดภาพเหลือ 25% เพื่อความเร็ว
+FRAME_SKIP_RATE = 2  # ประมวลผลทุกๆ 2 เฟรม (ลดการใช้ CPU) - starting value, tuned at runtime
+RESIZE_FACTOR = 0.25 # ย่อขนาดภาพเหลือ 25% เพื่อความเร็ว - starting value, tuned at runtime
+TARGET_LATENCY = 0.15          # Seconds per processed frame the adaptive controller aims for
+MIN_RESIZE_FACTOR = 0.2        # Lowest detection scale on slow boxes
+MAX_RESIZE_FACTOR = 0.5        # Highest detection scale on fast boxes or when faces are too small
+MIN_FACE_PX = 50               # Faces smaller than this at detection scale raise the scale
+QUALITY_THRESHOLD = 0.3        # Blurred, tiny, dark or profile faces scoring below this are never encoded
+BEST_FRAME_WINDOW = 0.3        # Seconds to wait for a sharper crop of a new face before encoding it
 TOLERANCE = 0.45     # ค่าความแม่นยำ (ยิ่งน้อยยิ่งเข้มงวด)
+MIN_MATCH_MARGIN = 0.0  # Required distance gap to the runner-up student (0 = closest match always wins)
+ANN_MIN_GALLERY_SIZE = 20000  # Use the approximate (IVF) index from this many students on (0 = always exact)
+ANN_N_PROBE = 8               # Inverted lists searched per face: higher = better recall, slower
+TRACK_IOU_THRESHOLD = 0.3     # Minimum box overlap to treat a face as the same person as in the last frame
+TRACK_REVERIFY_INTERVAL = 5   # Re-encode an identified face only every 5 seconds
+MOTION_GATE_ENABLED = True    # Skip face detection while the scene is static and empty
+MOTION_HOLD_SECONDS = 2       # Keep detecting for 2 seconds after the last motion
+GALLERY_REFRESH_INTERVAL = 60  # Seconds between delta syncs of the gallery with the server
+GALLERY_SYNC_WORKERS = 8       # Concurrent photo downloads during a sync
+# Comma-separated camera indices or stream URLs, e.g. "0,1" or "0,rtsp://door-2/stream"
+CAMERA_SOURCES = [
+    int(source) if source.strip().isdigit() else source.strip()
+    for source in os.getenv("CAMERA_SOURCES", "0").split(",") if source.strip()
+]
+# Recognition threads beside capture and render, shared fairly by all cameras; each
+# hands detection/encoding to one of as many worker processes (dlib holds the GIL)
+RECOGNITION_WORKERS = max(1, min(2 * len(CAMERA_SOURCES), (os.cpu_count() or 1) - 1))
+STATS_INTERVAL = 10  # Print per-camera FPS/latency every 10 seconds
 
 # UI Feedback Settings
 FEEDBACK_DURATION = 3  # แสดง Feedback ค้างไว้ 3 วินาที
+FACE_BOX_DURATION = 1  # Keep the last recognized boxes on screen for 1 second
+RENDER_WAIT = 0.05     # Seconds the render loop waits for new frames per round over all cameras
 COLOR_SUCCESS = (0, 255, 0)  # Green
 COLOR_WARNING = (0, 255, 255) # Yellow
 COLOR_ERROR = (0, 0, 255)    # Red
@@ -45,76 +83,32 @@ COLOR_BLACK = (0, 0, 0)
 # --- HELPER FUNCTIONS ---
 # ==============================================================================
 
-def sync_faces_from_server() -> Dict[str, dict]:
+def sync_faces_from_server() -> GallerySync:
     """
-    Downloads student images from the server if they don't exist locally
-    and returns a cache of student data.
+    Builds the gallery from the server (packed encodings, plus local encoding
+    of photos the server has no encoding for) and returns the syncer that
+    keeps it up to date in the background.
     """
     print("--- 1. Starting face synchronization from server... ---")
-    student_cache = {}
+    sync = GallerySync(
+        SERVER_API_BASE_URL, FACE_DIR, ENCODING_CACHE_DIR,
+        lambda encodings, names: build_gallery(encodings, names, ANN_MIN_GALLERY_SIZE, ANN_N_PROBE),
+        workers=GALLERY_SYNC_WORKERS,
+        device_key=SERVER_DEVICE_KEY,
+    )
     try:
-        response = requests.get(STUDENTS_ENDPOINT, timeout=10)
-        response.raise_for_status()
-        students = response.json()
-        print(f"-> Found {len(students)} students on the server.")
-
-        for student in students:
-            student_id = student.get("student_id")
-            image_url_from_server = student.get("image_url")
-            if not (student_id and image_url_from_server):
-                continue
-            
-            parsed_url = urlparse(image_url_from_server)
-            image_path = parsed_url.path
-            correct_download_url = f"{SERVER_API_BASE_URL}{image_path}"
-            local_filename = os.path.basename(image_path)
-            local_filepath = os.path.join(FACE_DIR, local_filename)
-
-            student_cache[student_id] = {"first_name": student.get("first_name", "N/A")}
-
-            if not os.path.exists(local_filepath):
-                print(f"-> New student found: {student_id}. Downloading image...")
-                try:
-                    img_response = requests.get(correct_download_url, stream=True, timeout=10)
-                    img_response.raise_for_status()
-                    with open(local_filepath, 'wb') as f:
-                        shutil.copyfileobj(img_response.raw, f)
-                    print(f"-> Successfully downloaded {local_filename}")
-                except requests.exceptions.RequestException as img_err:
-                    print(f"!!! ERROR: Could not download image for {student_id}: {img_err}")
-        
+        sync.refresh()
+        print(f"-> Found {len(sync.students)} students on the server.")
         print("--- Synchronization complete. ---")
-        return student_cache
-
-    except requests.exceptions.RequestException as e:
+    except DeviceKeyRejected as e:
+        print(f"!!! FATAL ERROR: The server rejected this device's key: {e}")
+        print("!!! Set SERVER_DEVICE_KEY to one of the keys in the server's DEVICE_API_KEYS.")
+        raise SystemExit(1)
+    except (requests.exceptions.RequestException, KeyError, ValueError) as e:
         print(f"!!! FATAL ERROR: Could not connect to the server: {e}")
-        print("!!! The program will only use existing local faces.")
-        return {}
-
-
-def post_attendance(attendee_id: str, sent_attendances: Set[str]) -> str:
-    """ Posts attendance and returns a status string for UI feedback. """
-    if attendee_id in sent_attendances:
-        return "ALREADY_ATTENDED"
-        
-    payload = {"attendee_id": attendee_id, "timestamp": int(time.time())}
-    try:
-        response = requests.post(ATTENDANCE_ENDPOINT, json=payload, timeout=5)
-        response.raise_for_status()
-        sent_attendances.add(attendee_id)
-        print(f"[SUCCESS] Attendance recorded for {attendee_id} at {time.strftime('%H:%M:%S')}")
-        return "SUCCESS"
-    except requests.exceptions.HTTPError as http_err:
-        if http_err.response.status_code == 400:
-            sent_attendances.add(attendee_id)
-            print(f"[WARNING] Already recorded today for {attendee_id}")
-            return "ALREADY_ATTENDED"
-        else:
-            print(f"[ERROR] HTTP error: {http_err}")
-            return "NETWORK_ERROR"
-    except requests.exceptions.RequestException as req_err:
-        print(f"[ERROR] Network error: {req_err}")
-        return "NETWORK_ERROR"
+        print("!!! The program will only use the last gallery downloaded from the server.")
+        sync.load_offline()
+    return sync
 
 
 def draw_feedback(frame, message, color):
@@ -125,109 +119,209 @@ def draw_feedback(frame, message, color):
     text_x = (w - text_size[0]) // 2
     cv2.putText(frame, message, (text_x, h - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, COLOR_BLACK, 2)
 
+
+class Camera:
+    """
+    Everything that belongs to one camera: its capture device and stream in
+    the shared pipeline, its own tracker, best-frame selector, motion gate and
+    adaptive controller, and the on-screen state of its window. The gallery,
+    the attendance sender and the recognition workers are shared by all.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.name = f"camera {source}"
+        self.window_name = WINDOW_NAME if len(CAMERA_SOURCES) == 1 else f"{WINDOW_NAME} - {self.name}"
+        self.cap = cv2.VideoCapture(source)
+        self.adaptive_controller = AdaptiveController(
+            target_latency=TARGET_LATENCY, scale=RESIZE_FACTOR, min_scale=MIN_RESIZE_FACTOR,
+            max_scale=MAX_RESIZE_FACTOR, frame_skip=FRAME_SKIP_RATE, min_face_px=MIN_FACE_PX,
+        )
+        self.best_frame_selector = BestFrameSelector(threshold=QUALITY_THRESHOLD, window=BEST_FRAME_WINDOW)
+        self.face_tracker = FaceTracker(iou_threshold=TRACK_IOU_THRESHOLD, reverify_interval=TRACK_REVERIFY_INTERVAL)
+        self.motion_gate = MotionGate(hold_seconds=MOTION_HOLD_SECONDS) if MOTION_GATE_ENABLED else None
+        self.stream = CameraStream(
+            self.name, self.cap, self.recognize_frame, frame_skip=FRAME_SKIP_RATE,
+            gate=self.motion_gate.check if self.motion_gate is not None else None,
+            # The stream reads the controller's frame skip each time it hands out a frame
+            controller=self.adaptive_controller,
+        )
+
+        self.shown_frame_id = 0
+        self.latest_faces = []
+        self.latest_faces_frame_id = 0
+        self.latest_faces_timer = 0
+        self.feedback_message = ""
+        self.feedback_color = COLOR_SUCCESS
+        self.feedback_timer = 0
+
+    def show_feedback(self, message, color):
+        self.feedback_message = message
+        self.feedback_color = color
+        self.feedback_timer = time.time()
+
+    def recognize_frame(self, frame):
+        """
+        Detects, encodes and matches the faces of a BGR frame. Runs on the
+        pipeline's worker threads and returns ``[(box, FaceMatch)]`` in full-frame
+        coordinates.
+        """
+        scale = self.adaptive_controller.scale
+        started = time.perf_counter()
+        small_frame = cv2.resize(frame, (0, 0), fx=scale, fy=scale)
+        rgb_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+
+        face_locations = face_pool.detect(rgb_frame)
+        detected = time.perf_counter()
+        if face_locations and self.motion_gate is not None:
+            # People standing still in view must keep being detected
+            self.motion_gate.keep_awake()
+        # Track in full-frame coordinates so boxes stay comparable when the scale changes
+        face_boxes = [tuple(int(v / scale) for v in location) for location in face_locations]
+        tracks = self.face_tracker.update(face_boxes)
+
+        # Only new faces and identified faces due for re-verification are encoded,
+        # using the best-quality crop of the face seen within BEST_FRAME_WINDOW
+        now = time.time()
+        to_encode = {}
+        for location, track in zip(face_locations, tracks):
+            if not self.face_tracker.needs_encoding(track, now):
+                continue
+            quality = score_face(rgb_frame, location, MIN_FACE_PX)
+            picked = self.best_frame_selector.offer(track.track_id, quality, rgb_frame, location, now)
+            if picked is not None:
+                picked_frame, picked_location = picked
+                to_encode.setdefault(id(picked_frame), (picked_frame, [], []))
+                to_encode[id(picked_frame)][1].append(picked_location)
+                to_encode[id(picked_frame)][2].append(track)
+        for picked_frame, picked_locations, picked_tracks in to_encode.values():
+            face_encodings = face_pool.encode(picked_frame, picked_locations)
+            for track, face_match in zip(picked_tracks, gallery_sync.gallery.match(face_encodings, TOLERANCE, MIN_MATCH_MARGIN)):
+                self.face_tracker.identify(track, face_match, now)
+        encoded = time.perf_counter()
+
+        smallest_face = min((bottom - top for top, _, bottom, _ in face_locations), default=None)
+        self.adaptive_controller.record({"detect": detected - started, "encode": encoded - detected}, smallest_face)
+
+        return [
+            (box, track.match)
+            for box, track in zip(face_boxes, tracks)
+            if track.match is not None
+        ]
+
+    def render(self):
+        """ Shows the newest frame of this camera with its boxes, feedback and stats, if there is a new one. """
+        captured = self.stream.next_frame(self.shown_frame_id, timeout=RENDER_WAIT / len(cameras))
+        if captured is None:
+            return
+        self.shown_frame_id = captured.frame_id
+        # Workers may still be reading this frame, so draw on a copy
+        frame = captured.image.copy()
+
+        for recognition in self.stream.poll():
+            if recognition.frame_id > self.latest_faces_frame_id:
+                self.latest_faces = recognition.faces
+                self.latest_faces_frame_id = recognition.frame_id
+                self.latest_faces_timer = time.time()
+
+            for _, face_match in recognition.faces:
+                name = face_match.name or "Unknown"
+
+                # --- Handle feedback ---
+                if name != "Unknown":
+                    # Posting happens in the background; the outcome is shown once it arrives
+                    submitted_by[name] = self
+                    if attendance_sender.submit(name) == STATUS_ALREADY_ATTENDED:
+                        self.show_feedback("Already Checked In Today", COLOR_WARNING)
+                else:
+                    self.show_feedback("Unknown Face Detected", COLOR_ERROR)
+
+        # --- Draw the most recent recognition on frame ---
+        if time.time() - self.latest_faces_timer < FACE_BOX_DURATION:
+            for (top, right, bottom, left), face_match in self.latest_faces:
+                name = face_match.name or "Unknown"
+                cv2.rectangle(frame, (left, top), (right, bottom), COLOR_SUCCESS, 2)
+                cv2.rectangle(frame, (left, bottom - 35), (right, bottom), COLOR_BLACK, cv2.FILLED)
+                cv2.putText(frame, name, (left + 6, bottom - 6), cv2.FONT_HERSHEY_DUPLEX, 1.0, COLOR_WHITE, 1)
+
+        stats = self.stream.stats.snapshot()
+        cv2.putText(
+            frame, f"{stats['capture_fps']:.0f} fps | {stats['recognition_fps']:.1f} rec/s | {stats['latency'] * 1000:.0f} ms",
+            (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.6, COLOR_WHITE, 1,
+        )
+
+        # Show feedback if timer is active
+        if time.time() - self.feedback_timer < FEEDBACK_DURATION:
+            draw_feedback(frame, self.feedback_message, self.feedback_color)
+
+        # Display the resulting image
+        cv2.imshow(self.window_name, frame)
+
 # ==============================================================================
 # --- MAIN EXECUTION ---
 # ==============================================================================
 
-# 1. Sync data and get student info
-student_data_cache = sync_faces_from_server()
-
-# 2. Load known faces from local files
-print("\n--- 2. Loading known faces into memory... ---")
-known_face_encodings, known_face_names = [], []
-for student_id in student_data_cache.keys():
-    # Find any image file starting with the student_id
-    image_file = next((f for f in os.listdir(FACE_DIR) if f.startswith(student_id)), None)
-    if image_file:
-        img_path = os.path.join(FACE_DIR, image_file)
-        try:
-            image = face_recognition.load_image_file(img_path)
-            encodings = face_recognition.face_encodings(image)
-            if encodings:
-                known_face_encodings.append(encodings[0])
-                known_face_names.append(student_id)
-                print(f"  - Loaded face for: {student_id}")
-            else:
-                print(f"  - WARNING: No face found in {img_path}")
-        except Exception as e:
-            print(f"  - ERROR: Could not process {img_path}: {e}")
-print(f"--- Finished loading {len(known_face_names)} faces. ---\n")
-
-# 3. Initialize camera, attendance set, and UI variables
-sent_attendances: Set[str] = set()
-cap = cv2.VideoCapture(0)
-if not cap.isOpened():
-    print("!!! FATAL ERROR: Cannot open camera")
-    exit()
-
-print("--- 3. Starting camera stream. Press 'q' in the video window to quit ---")
-
-frame_count = 0
-feedback_message = ""
-feedback_color = COLOR_SUCCESS
-feedback_timer = 0
-
-# 4. Main Loop
+# dlib runs in worker processes, forked before any other thread exists
+face_pool = FaceProcessPool(RECOGNITION_WORKERS)
+
+# 1. Sync data and get student info, 2. Load known faces into memory
+#    (one gallery in this process, shared by the workers of every camera)
+gallery_sync = sync_faces_from_server()
+print(f"--- Finished loading {len(gallery_sync.gallery)} faces. ---\n")
+
+# 3. Initialize cameras, attendance sender, and UI variables
+attendance_sender = AttendanceSender(
+    ATTENDANCE_ENDPOINT, spool=AttendanceSpool(ATTENDANCE_SPOOL_PATH), batch_endpoint=ATTENDANCE_BATCH_ENDPOINT,
+)
+cameras = [Camera(source) for source in CAMERA_SOURCES]
+for camera in cameras:
+    if not camera.cap.isOpened():
+        print(f"!!! FATAL ERROR: Cannot open {camera.name}")
+        exit()
+
+print(f"--- 3. Starting {len(cameras)} camera stream(s) with {RECOGNITION_WORKERS} recognition workers and processes. Press 'q' in a video window to quit ---")
+
+# Capture and recognition run on their own threads; this loop only renders
+pipeline = MultiStreamPipeline([camera.stream for camera in cameras], workers=RECOGNITION_WORKERS)
+pipeline.start()
+# New, updated and removed students reach the running gallery without restarting the camera loop
+gallery_sync.start(GALLERY_REFRESH_INTERVAL)
+
+submitted_by = {}    # attendee_id -> camera whose window shows the server's answer
+stats_timer = time.time()
+
+# 4. Main Loop (render)
 while True:
-    ret, frame = cap.read()
-    if not ret:
-        print("Cannot read frame, retrying...")
-        time.sleep(1)
-        continue
-
-    frame_count += 1
-    
-    # Process only on specified frame rate to save CPU
-    if frame_count % FRAME_SKIP_RATE == 0:
-        small_frame = cv2.resize(frame, (0, 0), fx=RESIZE_FACTOR, fy=RESIZE_FACTOR)
-        rgb_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
-        
-        face_locations = face_recognition.face_locations(rgb_frame)
-        face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
-
-        for (top, right, bottom, left), face_encoding in zip(face_locations, face_encodings):
-            matches = face_recognition.compare_faces(known_face_encodings, face_encoding, tolerance=TOLERANCE)
-            name = "Unknown"
-
-            if True in matches:
-                first_match_index = matches.index(True)
-                name = known_face_names[first_match_index]
-            
-            # --- Handle feedback ---
-            if name != "Unknown":
-                result = post_attendance(name, sent_attendances)
-                if result == "SUCCESS":
-                    first_name = student_data_cache.get(name, {}).get('first_name', name)
-                    feedback_message = f"Check-in Success: {first_name}"
-                    feedback_color = COLOR_SUCCESS
-                    feedback_timer = time.time()
-                elif result == "ALREADY_ATTENDED":
-                    feedback_message = "Already Checked In Today"
-                    feedback_color = COLOR_WARNING
-                    feedback_timer = time.time()
-            else:
-                feedback_message = "Unknown Face Detected"
-                feedback_color = COLOR_ERROR
-                feedback_timer = time.time()
-
-            # --- Draw on frame ---
-            top, right, bottom, left = [int(v / RESIZE_FACTOR) for v in (top, right, bottom, left)]
-            cv2.rectangle(frame, (left, top), (right, bottom), COLOR_SUCCESS, 2)
-            cv2.rectangle(frame, (left, bottom - 35), (right, bottom), COLOR_BLACK, cv2.FILLED)
-            cv2.putText(frame, name, (left + 6, bottom - 6), cv2.FONT_HERSHEY_DUPLEX, 1.0, COLOR_WHITE, 1)
-
-    # Show feedback if timer is active
-    if time.time() - feedback_timer < FEEDBACK_DURATION:
-        draw_feedback(frame, feedback_message, feedback_color)
-    
-    # Display the resulting image
-    cv2.imshow(WINDOW_NAME, frame)
+    for camera in cameras:
+        camera.render()
+
+    # --- Feedback for check-ins answered by the server ---
+    for attendee_id, result in attendance_sender.poll():
+        camera = submitted_by.pop(attendee_id, cameras[0])
+        first_name = gallery_sync.students.get(attendee_id, {}).get('first_name', attendee_id)
+        if result == STATUS_SUCCESS:
+            camera.show_feedback(f"Check-in Success: {first_name}", COLOR_SUCCESS)
+        elif result == STATUS_SAVED_OFFLINE:
+            camera.show_feedback(f"Check-in Saved (Offline): {first_name}", COLOR_WARNING)
+        elif result == STATUS_ALREADY_ATTENDED:
+            camera.show_feedback("Already Checked In Today", COLOR_WARNING)
+
+    if time.time() - stats_timer >= STATS_INTERVAL:
+        stats_timer = time.time()
+        for name, stats in pipeline.stats().items():
+            print(f"[STATS] {name}: {stats['capture_fps']:.1f} fps captured, "
+                  f"{stats['recognition_fps']:.1f} frames/s recognized, {stats['latency'] * 1000:.0f} ms latency")
 
     # Hit 'q' on the keyboard to quit!
     if cv2.waitKey(1) & 0xFF == ord('q'):
         break
 
 # 5. Cleanup
-cap.release()
+pipeline.stop()
+face_pool.close()
+gallery_sync.stop()
+attendance_sender.close()
+for camera in cameras:
+    camera.cap.release()
 cv2.destroyAllWindows()
-print("--- Program terminated. ---")
\ No newline at end of file
+print("--- Program terminated. ---")
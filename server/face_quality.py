@@ -0,0 +1,104 @@
+import threading
+import time
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+import cv2
+import face_recognition
+import numpy as np
+
+# ==============================================================================
+# --- FACE QUALITY GATING AND BEST-FRAME SELECTION ---
+# ==============================================================================
+# Each detected box gets a 0..1 score from sharpness (variance of Laplacian),
+# size, brightness and a frontal-pose proxy (nose offset from the eye midpoint).
+# Faces below the threshold are never encoded; for the rest, the best crop seen
+# within a short window per track is the one that gets encoded.
+
+Location = Tuple[int, int, int, int]  # (top, right, bottom, left)
+
+
+class FaceQuality(NamedTuple):
+    sharpness: float
+    size: float
+    brightness: float
+    pose: float
+
+    @property
+    def total(self) -> float:
+        # A single bad dimension (blur, tiny, dark, profile) is enough to reject a face
+        return self.sharpness * self.size * self.brightness * self.pose
+
+
+def score_face(rgb_frame: np.ndarray, location: Location, min_face_px: int = 50,
+               sharpness_ref: float = 100.0) -> FaceQuality:
+    """ Scores one detected face of an RGB frame. """
+    top, right, bottom, left = location
+    h, w = rgb_frame.shape[:2]
+    crop = rgb_frame[max(0, top):min(h, bottom), max(0, left):min(w, right)]
+    if crop.size == 0:
+        return FaceQuality(0.0, 0.0, 0.0, 0.0)
+    gray = cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY)
+
+    sharpness = min(1.0, cv2.Laplacian(gray, cv2.CV_64F).var() / sharpness_ref)
+    size = min(1.0, (bottom - top) / float(min_face_px))
+    brightness = max(0.0, 1.0 - abs(float(gray.mean()) - 128.0) / 128.0)
+
+    pose = 1.0
+    landmarks = face_recognition.face_landmarks(rgb_frame, [location], model="small")
+    if landmarks:
+        points = landmarks[0]
+        left_eye = np.mean(points["left_eye"], axis=0)
+        right_eye = np.mean(points["right_eye"], axis=0)
+        nose = np.mean(points["nose_tip"], axis=0)
+        eye_distance = np.linalg.norm(right_eye - left_eye)
+        if eye_distance > 0:
+            yaw = abs(nose[0] - (left_eye[0] + right_eye[0]) / 2.0) / eye_distance
+            pose = max(0.0, 1.0 - float(yaw) / 0.5)
+
+    return FaceQuality(sharpness, size, brightness, pose)
+
+
+class _Candidate(NamedTuple):
+    quality: float
+    rgb_frame: Any
+    location: Location
+    first_seen: float
+
+
+class BestFrameSelector:
+    """
+    Buffers the best-scoring crop per track for ``window`` seconds and releases
+    it for encoding once the window has elapsed, or immediately when its score
+    reaches ``accept_score``. Thread-safe.
+    """
+
+    def __init__(self, threshold: float = 0.3, window: float = 0.3, accept_score: float = 0.8):
+        self.threshold = threshold
+        self.window = window
+        self.accept_score = accept_score
+        self.candidates: Dict[int, _Candidate] = {}
+        self.lock = threading.Lock()
+
+    def offer(self, track_id: int, quality: FaceQuality, rgb_frame, location: Location,
+              now: Optional[float] = None) -> Optional[Tuple[Any, Location]]:
+        """ Returns ``(rgb_frame, location)`` to encode for the track, or None to keep waiting. """
+        now = time.time() if now is None else now
+        score = quality.total
+        with self.lock:
+            self._prune(now)
+            best = self.candidates.get(track_id)
+            if score >= self.threshold and (best is None or score > best.quality):
+                first_seen = best.first_seen if best is not None else now
+                best = _Candidate(score, rgb_frame, location, first_seen)
+                self.candidates[track_id] = best
+            if best is None:
+                return None
+            if best.quality >= self.accept_score or now - best.first_seen >= self.window:
+                del self.candidates[track_id]
+                return best.rgb_frame, best.location
+            return None
+
+    def _prune(self, now: float) -> None:
+        stale = [track_id for track_id, candidate in self.candidates.items() if now - candidate.first_seen > self.window * 4]
+        for track_id in stale:
+            del self.candidates[track_id]
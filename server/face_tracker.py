@@ -0,0 +1,112 @@
+import itertools
+import threading
+import time
+from typing import List, Optional, Sequence, Tuple
+
+from gallery import FaceMatch
+
+# ==============================================================================
+# --- LIGHTWEIGHT MULTI-FACE TRACKER ---
+# ==============================================================================
+# Associates ``face_locations`` boxes across frames by IoU so a student that
+# has been identified keeps their identity without re-running the 128-d
+# encoder on every frame. Identified tracks are only re-encoded every
+# ``reverify_interval`` seconds; unidentified ones every ``unknown_retry_interval``.
+# An identity that fails ``max_reverify_failures`` re-verifications in a row is dropped.
+
+Box = Tuple[int, int, int, int]  # (top, right, bottom, left) as returned by face_recognition
+
+
+def box_iou(a: Box, b: Box) -> float:
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    if inter == 0:
+        return 0.0
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    return inter / float(area_a + area_b - inter)
+
+
+class Track:
+    __slots__ = ("track_id", "box", "match", "verified_at", "last_seen", "failed_reverifications")
+
+    def __init__(self, track_id: int, box: Box, now: float):
+        self.track_id = track_id
+        self.box = box
+        self.match: Optional[FaceMatch] = None
+        self.verified_at = float("-inf")
+        self.last_seen = now
+        self.failed_reverifications = 0
+
+    @property
+    def name(self) -> Optional[str]:
+        return self.match.name if self.match is not None else None
+
+
+class FaceTracker:
+    """ Greedy IoU tracker that remembers the identity of each face between frames. """
+
+    def __init__(self, iou_threshold: float = 0.3, max_age: float = 1.0,
+                 reverify_interval: float = 5.0, unknown_retry_interval: float = 0.5, max_reverify_failures: int = 3):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.reverify_interval = reverify_interval
+        self.unknown_retry_interval = unknown_retry_interval
+        self.max_reverify_failures = max_reverify_failures
+        self.tracks: List[Track] = []
+        self.ids = itertools.count(1)
+        # Recognition workers share one tracker
+        self.lock = threading.Lock()
+
+    def update(self, boxes: Sequence[Box], now: Optional[float] = None) -> List[Track]:
+        """ Returns one track per box, continuing existing tracks where the boxes overlap enough. """
+        now = time.time() if now is None else now
+        with self.lock:
+            self.tracks = [track for track in self.tracks if now - track.last_seen <= self.max_age]
+
+            pairs = sorted(
+                ((box_iou(track.box, box), t, b) for t, track in enumerate(self.tracks) for b, box in enumerate(boxes)),
+                reverse=True,
+            )
+            assigned: List[Optional[Track]] = [None] * len(boxes)
+            used_tracks = set()
+            for iou, t, b in pairs:
+                if iou < self.iou_threshold:
+                    break
+                if t in used_tracks or assigned[b] is not None:
+                    continue
+                used_tracks.add(t)
+                assigned[b] = self.tracks[t]
+
+            for b, box in enumerate(boxes):
+                track = assigned[b]
+                if track is None:
+                    track = Track(next(self.ids), box, now)
+                    self.tracks.append(track)
+                    assigned[b] = track
+                track.box = box
+                track.last_seen = now
+            return assigned
+
+    def needs_encoding(self, track: Track, now: Optional[float] = None) -> bool:
+        """ Whether the track has no identity yet or is due for periodic re-verification. """
+        now = time.time() if now is None else now
+        interval = self.reverify_interval if track.name is not None else self.unknown_retry_interval
+        return now - track.verified_at >= interval
+
+    def identify(self, track: Track, match: FaceMatch, now: Optional[float] = None) -> None:
+        """
+        Records a fresh match. A failed re-verification keeps the previous
+        identity (the face may just be turned away) until ``max_reverify_failures``
+        checks in a row have failed; the track then becomes unidentified.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            track.verified_at = now
+            if match.name is None and track.name is not None:
+                track.failed_reverifications += 1
+                if track.failed_reverifications < self.max_reverify_failures:
+                    return
+            track.match = match
+            track.failed_reverifications = 0
@@ -0,0 +1,249 @@
+import copy
+import struct
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from encoding_cache import ENCODING_DIM
+
+KMEANS_CHUNK = 8192
+
+# ==============================================================================
+# --- VECTORIZED GALLERY MATCHER ---
+# ==============================================================================
+
+
+class FaceMatch(NamedTuple):
+    """ Best gallery match for one probe face. ``name`` is None when no student is within tolerance. """
+    name: Optional[str]
+    distance: float
+    margin: float
+
+
+class FaceGallery:
+    """
+    Holds every known encoding in one contiguous float32 matrix and matches all
+    faces of a frame against it with a single batched distance computation.
+    A gallery is never modified once built: ``with_encodings`` returns an
+    updated copy, so threads matching against the old one are unaffected.
+    """
+
+    def __init__(self, encodings: np.ndarray, names: Sequence[str]):
+        self.encodings = np.ascontiguousarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        self.names: List[str] = list(names)
+        if len(self.names) != len(self.encodings):
+            raise ValueError("encodings and names must have the same length")
+        self.rows = {name: row for row, name in enumerate(self.names)}
+        self.sq_norms = np.einsum("ij,ij->i", self.encodings, self.encodings)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def with_encodings(self, encodings: Dict[str, np.ndarray]) -> "FaceGallery":
+        """ Returns a copy of the gallery with the given students added or their encodings replaced. """
+        gallery = copy.copy(self)
+        gallery._detach()
+        for name, encoding in encodings.items():
+            gallery._add(name, encoding)
+        return gallery
+
+    def _detach(self) -> None:
+        # Gives a shallow copy its own arrays, which _add may then change in place
+        self.encodings = self.encodings.copy()
+        self.sq_norms = self.sq_norms.copy()
+        self.names = list(self.names)
+        self.rows = dict(self.rows)
+
+    def _add(self, name: str, encoding: np.ndarray) -> None:
+        encoding = np.asarray(encoding, dtype=np.float32).reshape(ENCODING_DIM)
+        row = self.rows.get(name)
+        if row is not None:
+            self.encodings[row] = encoding
+            self.sq_norms[row] = encoding @ encoding
+            return
+        self.encodings = np.vstack([self.encodings, encoding[None, :]])
+        self.sq_norms = np.append(self.sq_norms, encoding @ encoding)
+        self.rows[name] = len(self.names)
+        self.names.append(name)
+
+    def distances(self, face_encodings: Sequence[np.ndarray], rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """ Returns the (faces x gallery) matrix of euclidean distances, optionally restricted to ``rows``. """
+        probes = np.asarray(face_encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        encodings, sq_norms = self.encodings, self.sq_norms
+        if rows is not None:
+            encodings, sq_norms = encodings[rows], sq_norms[rows]
+        return _euclidean(probes, encodings, sq_norms)
+
+    def match(self, face_encodings: Sequence[np.ndarray], tolerance: float, min_margin: float = 0.0) -> List[FaceMatch]:
+        """
+        Returns the closest student for every probe face, together with its
+        distance and the margin to the runner-up. Matches farther than
+        ``tolerance`` or closer than ``min_margin`` to the runner-up are rejected.
+        """
+        if len(face_encodings) == 0:
+            return []
+        if len(self) == 0:
+            return [FaceMatch(None, float("inf"), 0.0) for _ in face_encodings]
+
+        best_idx, best_dist, margins = _nearest_two(self.distances(face_encodings))
+        return self._to_matches(best_idx, best_dist, margins, tolerance, min_margin)
+
+    def _to_matches(self, best_idx, best_dist, margins, tolerance: float, min_margin: float) -> List[FaceMatch]:
+        matches = []
+        for idx, distance, margin in zip(best_idx, best_dist, margins):
+            accepted = distance <= tolerance and margin >= min_margin
+            matches.append(FaceMatch(self.names[idx] if accepted else None, float(distance), float(margin)))
+        return matches
+
+
+class IVFFaceGallery(FaceGallery):
+    """
+    Approximate gallery for very large deployments. Encodings are partitioned
+    with k-means into ``n_lists`` inverted lists once at load time; each probe
+    is only compared against the ``n_probe`` lists whose centroids are nearest.
+    Raising ``n_probe`` trades speed for recall (``n_probe == n_lists`` is exact).
+    """
+
+    def __init__(self, encodings: np.ndarray, names: Sequence[str], n_lists: Optional[int] = None,
+                 n_probe: int = 8, kmeans_iters: int = 10, seed: int = 0):
+        super().__init__(encodings, names)
+        self.n_probe = n_probe
+        self.centroids = np.empty((0, ENCODING_DIM), dtype=np.float32)
+        self.assignments = np.empty(0, dtype=np.intp)
+        self.lists: List[np.ndarray] = []
+        if len(self) > 0:
+            self._train(n_lists or int(np.sqrt(len(self))), kmeans_iters, seed)
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        """ Returns the nearest centroid of every vector, in chunks to bound memory. """
+        centroid_sq = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        assignments = np.empty(len(vectors), dtype=np.intp)
+        for start in range(0, len(vectors), KMEANS_CHUNK):
+            chunk = vectors[start:start + KMEANS_CHUNK]
+            assignments[start:start + KMEANS_CHUNK] = np.argmin(_euclidean(chunk, self.centroids, centroid_sq), axis=1)
+        return assignments
+
+    def _train(self, n_lists: int, kmeans_iters: int, seed: int) -> None:
+        n_lists = max(1, min(n_lists, len(self)))
+        rng = np.random.default_rng(seed)
+        self.centroids = self.encodings[rng.choice(len(self), n_lists, replace=False)].copy()
+        for _ in range(kmeans_iters):
+            self.assignments = self._assign(self.encodings)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, self.assignments, self.encodings)
+            counts = np.bincount(self.assignments, minlength=n_lists)
+            non_empty = counts > 0
+            self.centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+        self.assignments = self._assign(self.encodings)
+
+        order = np.argsort(self.assignments, kind="stable")
+        counts = np.bincount(self.assignments, minlength=n_lists)
+        self.lists = np.split(order, np.cumsum(counts)[:-1])
+
+    def _detach(self) -> None:
+        super()._detach()
+        self.centroids = self.centroids.copy()
+        self.assignments = self.assignments.copy()
+        self.lists = list(self.lists)
+
+    def _add(self, name: str, encoding: np.ndarray) -> None:
+        # Assigns the student to its nearest list without retraining
+        old_row = self.rows.get(name)
+        super()._add(name, encoding)
+        row = self.rows[name]
+        if len(self.centroids) == 0:
+            self._train(1, 0, 0)
+            return
+        target = int(self._assign(self.encodings[row:row + 1])[0])
+        if old_row is not None:
+            source = self.assignments[old_row]
+            if source == target:
+                return
+            self.lists[source] = self.lists[source][self.lists[source] != old_row]
+            self.assignments[row] = target
+        else:
+            self.assignments = np.append(self.assignments, target)
+        self.lists[target] = np.append(self.lists[target], row)
+
+    def match(self, face_encodings: Sequence[np.ndarray], tolerance: float, min_margin: float = 0.0) -> List[FaceMatch]:
+        if len(face_encodings) == 0:
+            return []
+        if len(self) == 0:
+            return [FaceMatch(None, float("inf"), 0.0) for _ in face_encodings]
+
+        probes = np.asarray(face_encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        n_probe = min(self.n_probe, len(self.centroids))
+        centroid_sq = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        probe_lists = np.argpartition(_euclidean(probes, self.centroids, centroid_sq), n_probe - 1, axis=1)[:, :n_probe]
+
+        best_idx, best_dist, margins = [], [], []
+        for probe, lists in zip(probes, probe_lists):
+            candidates = np.concatenate([self.lists[i] for i in lists])
+            if len(candidates) == 0:
+                candidates = np.arange(len(self))
+            idx, dist, margin = _nearest_two(self.distances(probe, candidates))
+            best_idx.append(candidates[idx[0]])
+            best_dist.append(dist[0])
+            margins.append(margin[0])
+        return self._to_matches(best_idx, best_dist, margins, tolerance, min_margin)
+
+
+def _euclidean(probes: np.ndarray, encodings: np.ndarray, sq_norms: np.ndarray) -> np.ndarray:
+    sq = np.einsum("ij,ij->i", probes, probes)[:, None] + sq_norms[None, :] - 2.0 * (probes @ encodings.T)
+    return np.sqrt(np.maximum(sq, 0.0))
+
+
+def _nearest_two(dist: np.ndarray):
+    """ Returns the nearest column, its distance and the margin to the runner-up for every row. """
+    rows = np.arange(len(dist))
+    if dist.shape[1] > 1:
+        # kth=1 puts the nearest in column 0 and the runner-up in column 1
+        nearest = np.argpartition(dist, 1, axis=1)[:, :2]
+        best_idx = nearest[:, 0]
+        margins = dist[rows, nearest[:, 1]] - dist[rows, best_idx]
+    else:
+        best_idx = np.zeros(len(dist), dtype=np.intp)
+        margins = np.full(len(dist), np.inf)
+    return best_idx, dist[rows, best_idx], margins
+
+
+def build_gallery(encodings: np.ndarray, names: Sequence[str], ann_min_size: int, n_probe: int) -> FaceGallery:
+    """ Returns an exact gallery, or an IVF-indexed one once it holds ``ann_min_size`` students or more. """
+    if ann_min_size > 0 and len(names) >= ann_min_size:
+        return IVFFaceGallery(encodings, names, n_probe=n_probe)
+    return FaceGallery(encodings, names)
+
+
+# ==============================================================================
+# --- PACKED GALLERY FORMAT ---
+# ==============================================================================
+# Header (magic, count, dim, byte length of the ids), the little-endian float32
+# matrix, then the student ids as UTF-8 joined by newlines. The header is 16
+# bytes, so the matrix can be read in place with np.frombuffer.
+
+PACKED_MAGIC = b"FTG1"
+_PACKED_HEADER = struct.Struct("<4sIII")
+
+
+def pack_gallery(encodings: np.ndarray, names: Sequence[str]) -> bytes:
+    matrix = np.ascontiguousarray(encodings, dtype="<f4").reshape(-1, ENCODING_DIM)
+    if len(names) != len(matrix):
+        raise ValueError(f"{len(names)} names for {len(matrix)} encodings")
+    ids = "\n".join(names).encode("utf-8")
+    return _PACKED_HEADER.pack(PACKED_MAGIC, len(matrix), ENCODING_DIM, len(ids)) + matrix.tobytes() + ids
+
+
+def unpack_gallery(blob: bytes) -> Tuple[np.ndarray, List[str]]:
+    """ Inverse of ``pack_gallery``; raises ValueError for a truncated or foreign blob. """
+    if len(blob) < _PACKED_HEADER.size:
+        raise ValueError("packed gallery is truncated")
+    magic, count, dim, ids_length = _PACKED_HEADER.unpack_from(blob)
+    matrix_length = count * dim * 4
+    if magic != PACKED_MAGIC or dim != ENCODING_DIM or len(blob) != _PACKED_HEADER.size + matrix_length + ids_length:
+        raise ValueError("not a packed gallery")
+    encodings = np.frombuffer(blob, dtype="<f4", count=count * dim, offset=_PACKED_HEADER.size).reshape(count, dim)
+    ids = blob[_PACKED_HEADER.size + matrix_length:].decode("utf-8")
+    names = ids.split("\n") if count else []
+    if len(names) != count:
+        raise ValueError("not a packed gallery")
+    return encodings.astype(np.float32), names
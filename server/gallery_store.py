@@ -0,0 +1,106 @@
+import hashlib
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+from firebase_admin import firestore
+
+from encoding_cache import ENCODING_DIM
+from gallery import FaceGallery, build_gallery, pack_gallery
+
+# Same switch-over to the approximate index as the recognition client
+ANN_MIN_GALLERY_SIZE = 20000
+ANN_N_PROBE = 8
+
+
+def encoding_to_bytes(encoding: np.ndarray) -> bytes:
+    """ Firestore representation of one encoding: 128 little-endian float32 values. """
+    return np.asarray(encoding, dtype="<f4").reshape(ENCODING_DIM).tobytes()
+
+
+class GalleryStore:
+    """
+    Packed ``(ids, float32 matrix)`` blob of every student's registered
+    encoding, served to kiosks so they start without encoding any image. The
+    same encodings back the in-memory gallery used for server-side
+    recognition. Both are rebuilt with one projected query when this process
+    invalidates them (on register/remove) or when a cheap version check, run
+    at most every ``check_interval`` seconds, sees a change made elsewhere.
+    The blob's ETag is a hash of its content.
+    """
+
+    def __init__(self, db, check_interval: float = 10):
+        self.db = db
+        self.check_interval = check_interval
+        # (blob, etag, gallery), replaced as a whole so readers never see a mix
+        self.snapshot: Optional[tuple[bytes, str, FaceGallery]] = None
+        self.version: Optional[tuple] = None
+        self.checked_at = 0.0
+        self.stale = True
+        # Held only by the thread refreshing; readers keep the current snapshot meanwhile
+        self.refresh_lock = threading.Lock()
+
+    def packed(self) -> tuple[bytes, str]:
+        blob, etag, _ = self._current()
+        return blob, etag
+
+    def matcher(self) -> FaceGallery:
+        """ Returns the gallery of every registered encoding; it is replaced, never mutated, on rebuild. """
+        return self._current()[2]
+
+    def invalidate(self) -> None:
+        self.stale = True
+
+    def _current(self) -> tuple[bytes, str, FaceGallery]:
+        snapshot = self.snapshot
+        if snapshot is not None and not self.stale and time.monotonic() - self.checked_at < self.check_interval:
+            return snapshot
+        if snapshot is None:
+            # Nothing to serve yet: wait for whichever thread builds the first one
+            with self.refresh_lock:
+                if self.snapshot is None:
+                    self._refresh()
+            return self.snapshot
+        if self.refresh_lock.acquire(blocking=False):
+            try:
+                self._refresh()
+            except Exception as e:
+                print(f"Gallery: refresh failed, serving the previous gallery: {e}")
+            finally:
+                self.refresh_lock.release()
+        return self.snapshot
+
+    def _refresh(self) -> None:
+        # Cleared before reading, so an invalidation during the rebuild causes another one
+        forced, self.stale = self.stale, False
+        try:
+            version = self._version()
+            if self.snapshot is None or forced or version != self.version:
+                self._rebuild()
+                self.version = version
+        except Exception:
+            self.stale = self.stale or forced
+            raise
+        self.checked_at = time.monotonic()
+
+    def _version(self) -> tuple:
+        """ Latest registration and latest removal time: two one-document reads. """
+        latest = []
+        for collection, field in (("students", "updated_at"), ("student_deletions", "deleted_at")):
+            docs = list(self.db.collection(collection).order_by(field, direction=firestore.Query.DESCENDING).limit(1).select([field]).stream())
+            latest.append((docs[0].to_dict() or {}).get(field) if docs else None)
+        return tuple(latest)
+
+    def _rebuild(self) -> None:
+        names, rows = [], []
+        for student in self.db.collection("students").select(["encoding"]).stream():
+            encoding = (student.to_dict() or {}).get("encoding")
+            if isinstance(encoding, bytes) and len(encoding) == ENCODING_DIM * 4:
+                names.append(student.id)
+                rows.append(np.frombuffer(encoding, dtype="<f4"))
+        matrix = np.array(rows, dtype=np.float32).reshape(-1, ENCODING_DIM)
+
+        blob = pack_gallery(matrix, names)
+        gallery = build_gallery(matrix, names, ANN_MIN_GALLERY_SIZE, ANN_N_PROBE)
+        self.snapshot = (blob, '"' + hashlib.sha256(blob).hexdigest()[:32] + '"', gallery)
@@ -0,0 +1,240 @@
+import base64
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Sequence
+from urllib.parse import urlparse
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from encoding_cache import ENCODING_DIM, load_known_faces
+from gallery import FaceGallery, unpack_gallery
+
+# ==============================================================================
+# --- INCREMENTAL GALLERY SYNC ---
+# ==============================================================================
+# The first sync takes the server's packed gallery (revalidated with its ETag)
+# plus the full student list; every later one asks /students/changes/ only for
+# students added, updated or removed since the version returned last time.
+# Students the server holds no encoding for are downloaded concurrently over
+# one pooled session with conditional GETs and encoded locally. Encodings are
+# only served to instructors and to devices, so the session sends the device
+# key (one of the server's DEVICE_API_KEYS) with every request.
+
+
+class DeviceKeyRejected(Exception):
+    """ The server answered 401/403: the device key is missing, wrong or revoked. """
+
+
+class GallerySync:
+    """
+    Keeps ``gallery`` and ``students`` (``{student_id: {"first_name", "last_name"}}``)
+    in step with the server. Every refresh that changes anything builds a new
+    gallery (``gallery.with_encodings`` for additions and updates, a full
+    rebuild for removals) and replaces the old one in a single assignment, so
+    recognition threads keep matching against a consistent gallery.
+    """
+
+    def __init__(self, base_url: str, face_dir: str, cache_dir: str,
+                 build: Callable[[np.ndarray, Sequence[str]], FaceGallery], workers: int = 8, timeout: float = 10,
+                 device_key: Optional[str] = None):
+        self.base_url = base_url
+        self.face_dir = face_dir
+        self.cache_dir = cache_dir
+        self.build = build
+        self.workers = workers
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        if device_key:
+            self.session.headers["X-Device-Key"] = device_key
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.version = 0
+        self.students: Dict[str, dict] = {}
+        self.encodings: Dict[str, np.ndarray] = {}
+        self.image_paths: Dict[str, str] = {}  # students encoded locally from their photo
+        self.gallery = build(np.empty((0, ENCODING_DIM), dtype=np.float32), [])
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+        self.blob_path = os.path.join(cache_dir, "gallery.bin")
+        self.etags_path = os.path.join(cache_dir, "etags.json")
+        self.etags = self._load_etags()
+
+    def refresh(self) -> bool:
+        """ Applies the server's changes since the last sync; returns True if the gallery changed. """
+        with self.lock:
+            first = self.version == 0
+            response = self._get(
+                f"{self.base_url}/students/changes/",
+                params={"since": self.version, "encodings": str(not first).lower()},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            changes = response.json()["data"]
+
+            packed = self._fetch_packed_gallery() if first else {}
+            upserted, deleted = changes["upserted"], set(changes["deleted"])
+            if first:
+                # Anything this client knew before (e.g. from the offline cache) and the server no longer lists
+                deleted |= set(self.encodings) - {student["attendee_id"] for student in upserted}
+
+            updated, downloads = {}, {}
+            for student in upserted:
+                student_id = student["attendee_id"]
+                self.students[student_id] = {"first_name": student["first_name"], "last_name": student["last_name"]}
+                if student.get("encoding"):
+                    updated[student_id] = np.frombuffer(base64.b64decode(student["encoding"]), dtype="<f4")
+                    self.image_paths.pop(student_id, None)
+                elif student_id in packed:
+                    updated[student_id] = packed[student_id]
+                    self.image_paths.pop(student_id, None)
+                elif student.get("image_url"):
+                    downloads[student_id] = student["image_url"]
+            for student_id in deleted:
+                self.students.pop(student_id, None)
+                self.image_paths.pop(student_id, None)
+
+            if downloads:
+                updated.update(self._encode_images(downloads))
+
+            removed = [student_id for student_id in deleted if self.encodings.pop(student_id, None) is not None]
+            self.encodings.update(updated)
+            if first or removed:
+                names = list(self.encodings)
+                matrix = np.array([self.encodings[name] for name in names], dtype=np.float32).reshape(-1, ENCODING_DIM)
+                self.gallery = self.build(matrix, names)
+            elif updated:
+                self.gallery = self.gallery.with_encodings(updated)
+
+            self.version = changes["version"]
+            if updated or removed:
+                print(f"-> Gallery sync: {len(updated)} added or updated, {len(removed)} removed, {len(self.gallery)} faces")
+            return bool(updated or removed)
+
+    def load_offline(self) -> None:
+        """ Seeds the gallery from the last packed gallery on disk when the server is unreachable. """
+        with self.lock:
+            self.encodings = self._read_packed_gallery()
+            names = list(self.encodings)
+            matrix = np.array([self.encodings[name] for name in names], dtype=np.float32).reshape(-1, ENCODING_DIM)
+            self.gallery = self.build(matrix, names)
+
+    def start(self, interval: float) -> None:
+        """ Refreshes every ``interval`` seconds on a daemon thread until ``stop()``. """
+        def run():
+            while not self.stop_event.wait(interval):
+                try:
+                    self.refresh()
+                except DeviceKeyRejected as e:
+                    print(f"!!! ERROR: Gallery sync rejected, keeping the current gallery: {e}")
+                except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+                    print(f"  - WARNING: Gallery sync failed, keeping the current gallery: {e}")
+
+        self.thread = threading.Thread(target=run, name="gallery-sync", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.timeout)
+        self.session.close()
+
+    # --- Downloads ---
+
+    def _get(self, url: str, **kwargs) -> requests.Response:
+        """ GET with the device key; raises DeviceKeyRejected if the server refuses it. """
+        response = self.session.get(url, **kwargs)
+        if response.status_code in (401, 403):
+            try:
+                detail = response.json().get("detail")
+            except ValueError:
+                detail = response.reason
+            raise DeviceKeyRejected(f"{response.status_code} from {urlparse(url).path}: {detail}")
+        return response
+
+    def _fetch_packed_gallery(self) -> Dict[str, np.ndarray]:
+        headers = {}
+        if os.path.exists(self.blob_path) and "gallery" in self.etags:
+            headers["If-None-Match"] = self.etags["gallery"]
+        try:
+            response = self._get(f"{self.base_url}/gallery/", headers=headers, timeout=self.timeout * 3)
+            if response.status_code == 200:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                with open(self.blob_path + ".tmp", "wb") as f:
+                    f.write(response.content)
+                os.replace(self.blob_path + ".tmp", self.blob_path)
+                self.etags["gallery"] = response.headers.get("ETag", "")
+                self._save_etags()
+                print(f"-> Downloaded packed gallery ({len(response.content)} bytes)")
+            elif response.status_code != 304:
+                response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            print(f"  - WARNING: Could not download packed gallery: {e}")
+        return self._read_packed_gallery()
+
+    def _read_packed_gallery(self) -> Dict[str, np.ndarray]:
+        if not os.path.exists(self.blob_path):
+            return {}
+        try:
+            with open(self.blob_path, "rb") as f:
+                encodings, names = unpack_gallery(f.read())
+        except (OSError, ValueError) as e:
+            print(f"  - WARNING: Ignoring unreadable packed gallery: {e}")
+            return {}
+        return dict(zip(names, encodings))
+
+    def _encode_images(self, image_urls: Dict[str, str]) -> Dict[str, np.ndarray]:
+        """ Downloads the given photos concurrently and returns the encodings of the ones with a face. """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            paths = dict(zip(image_urls, executor.map(self._download_image, image_urls.values())))
+        self._save_etags()
+        self.image_paths.update({student_id: path for student_id, path in paths.items() if path is not None})
+
+        # Unchanged photos hit the local encoding cache; all photo-backed students are passed so none is evicted
+        encodings, names = load_known_faces(self.image_paths, self.cache_dir)
+        return {name: encoding for name, encoding in zip(names, encodings) if name in image_urls}
+
+    def _download_image(self, image_url: str) -> Optional[str]:
+        local_path = os.path.join(self.face_dir, os.path.basename(urlparse(image_url).path))
+        headers = {}
+        if os.path.exists(local_path) and image_url in self.etags:
+            headers["If-None-Match"] = self.etags[image_url]
+        try:
+            response = self.session.get(f"{self.base_url}{image_url}", headers=headers, timeout=self.timeout)
+            if response.status_code == 304:
+                return local_path
+            response.raise_for_status()
+            with open(local_path + ".tmp", "wb") as f:
+                f.write(response.content)
+            os.replace(local_path + ".tmp", local_path)
+            if "ETag" in response.headers:
+                self.etags[image_url] = response.headers["ETag"]
+            return local_path
+        except (requests.exceptions.RequestException, OSError) as e:
+            print(f"!!! ERROR: Could not download {image_url}: {e}")
+            # An older copy is still better than no face at all
+            return local_path if os.path.exists(local_path) else None
+
+    def _load_etags(self) -> Dict[str, str]:
+        try:
+            with open(self.etags_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_etags(self) -> None:
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self.etags_path + ".tmp", "w") as f:
+                json.dump(self.etags, f)
+            os.replace(self.etags_path + ".tmp", self.etags_path)
+        except OSError as e:
+            print(f"  - WARNING: Could not write ETag cache: {e}")
@@ -1,17 +1,31 @@
 import os
-from datetime import datetime, timezone, timedelta
+import base64
+from datetime import date, datetime, timezone, timedelta
 from dotenv import load_dotenv
 import jwt
-from fastapi import FastAPI, HTTPException, status, Query, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, status, Query, Header, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+import anyio
 import firebase_admin
 from firebase_admin import auth, credentials, firestore
+import face_recognition
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition
 from google.cloud.firestore_v1 import FieldFilter
 from pydantic import BaseModel
-from auth_middleware import AuthMiddleware, JWT_SECRET_KEY, JWT_ALGORITHM, EXEMPT_ROUTES
+from auth_middleware import AuthMiddleware, JWT_SECRET_KEY, JWT_ALGORITHM, EXEMPT_ROUTES, DEVICE_ROUTES, DEVICE_API_KEYS, verified_users
+from body_limit import BodySizeLimitMiddleware
+from student_directory import StudentDirectory
+from gallery_store import GalleryStore, encoding_to_bytes
+from recognition_engine import RecognitionEngine
+from enrollment_image import crop_face, file_etag, load_enrollment_image, save_enrollment_image
+from attendance_log import DailyAttendanceLog
+from attendance_buffer import BufferFullError, WriteBehindBuffer
+from attendance_spool import AttendanceSpool
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, encode_cursor, decode_cursor, ndjson_lines
+from attendance_rollups import BUCKET_SECONDS, RollupCounter, load_rollups, start_of_day, week_days
 from typing import Optional
-import shutil
 
 
 # โหลด service account key
@@ -20,10 +34,44 @@ firebase_admin.initialize_app(cred)
 
 app = FastAPI()
 db = firestore.client()
+studentDirectory = StudentDirectory(db)
+galleryStore = GalleryStore(db)
+# Counts check-ins for /insights/ apart from the attendance commits
+rollupCounter = RollupCounter(db)
+
+# Enrollment photos (face-centered, downscaled) and their thumbnails in FACES_DIR/thumbs
+FACES_DIR = "faces"
+os.makedirs(FACES_DIR, exist_ok=True)
+
+# Removed students, kept so delta syncs (/students/changes/) can report deletions
+STUDENT_DELETIONS_COLLECTION = "student_deletions"
+
+def nowMillis() -> int:
+	return int(datetime.now(tz=timezone.utc).timestamp() * 1000)
+
+def attendanceDocId(attendeeId: str, attendanceDate: date) -> str:
+	# One document per student per UTC day, so creating it twice is rejected by Firestore itself
+	return f"{attendeeId}_{attendanceDate.strftime('%Y%m%d')}"
+
+def loadAttendancesOfDay(attendanceDate: date) -> dict[str, int]:
+	startOfDay = int(datetime(attendanceDate.year, attendanceDate.month, attendanceDate.day, tzinfo=timezone.utc).timestamp())
+	endOfDay = int(datetime(attendanceDate.year, attendanceDate.month, attendanceDate.day, 23, 59, 59, tzinfo=timezone.utc).timestamp())
+	docs = db.collection("attendances") \
+		.where(filter=FieldFilter("timestamp", ">=", startOfDay)) \
+		.where(filter=FieldFilter("timestamp", "<=", endOfDay)) \
+		.select(["attendee_id", "timestamp"]) \
+		.stream()
+	attendances = (doc.to_dict() for doc in docs)
+	return {attendance["attendee_id"]: attendance["timestamp"] for attendance in attendances if "attendee_id" in attendance}
+
+# Seeded with one query the first time a day is seen, then kept up to date by Attend
+attendanceLog = DailyAttendanceLog(loadAttendancesOfDay)
 
 app.add_middleware(
 	AuthMiddleware,
-	exempt_paths=EXEMPT_ROUTES
+	exempt_paths=EXEMPT_ROUTES,
+	device_paths=DEVICE_ROUTES,
+	device_keys=DEVICE_API_KEYS,
 )
 
 load_dotenv(".env.local")
@@ -67,9 +115,131 @@ class Instructor(BaseModel):
 	last_name: str | None = None
 	password: str | None = None
 
-# Receive and save attendance data from face recognition
-@app.post("/attendances/", status_code=status.HTTP_201_CREATED)
-async def Attend(attendance: Attendance):
+# Firestore accepts at most 500 writes per batch
+MAX_ATTENDANCE_BATCH = 500
+
+def createAttendance(docId: str, attendanceDict: dict) -> None:
+	"""Creates one attendance and counts it for the insights; fails if it already exists."""
+	db.collection("attendances").document(docId).create(attendanceDict)
+	rollupCounter.add([attendanceDict["timestamp"]])
+
+def writeAttendances(attendances: dict[str, dict]) -> dict[str, str]:
+	"""Creates attendance documents keyed by document id in batched commits; returns each id's status."""
+	statuses = {}
+	docIds = list(attendances)
+	for start in range(0, len(docIds), MAX_ATTENDANCE_BATCH):
+		chunk = docIds[start:start + MAX_ATTENDANCE_BATCH]
+		refs = { docId: db.collection("attendances").document(docId) for docId in chunk }
+		existing = { snapshot.id for snapshot in db.get_all(list(refs.values()), field_paths=["timestamp"]) if snapshot.exists }
+
+		batch = db.batch()
+		toCreate = []
+		for docId in chunk:
+			if docId in existing:
+				statuses[docId] = "already_attended"
+			else:
+				batch.create(refs[docId], attendances[docId])
+				toCreate.append(docId)
+
+		if not toCreate:
+			continue
+		try:
+			batch.commit()
+			statuses.update(dict.fromkeys(toCreate, "created"))
+			rollupCounter.add([attendances[docId]["timestamp"] for docId in toCreate])
+		except (AlreadyExists, FailedPrecondition):
+			# Another request created one of the documents after the read; the batch is atomic, so write one by one
+			for docId in toCreate:
+				try:
+					createAttendance(docId, attendances[docId])
+					statuses[docId] = "created"
+				except (AlreadyExists, FailedPrecondition):
+					statuses[docId] = "already_attended"
+	return statuses
+
+def flushAttendances(attendances: dict[str, dict]) -> None:
+	statuses = writeAttendances(attendances)
+	duplicates = [docId for docId, status in statuses.items() if status != "created"]
+	if duplicates:
+		print(f"Write-behind: {len(duplicates)} buffered attendances already existed: {duplicates}")
+
+# Optional write-behind mode: acknowledge check-ins once buffered, write them in batches
+ATTENDANCE_WRITE_BEHIND = os.getenv("ATTENDANCE_WRITE_BEHIND", "false").lower() == "true"
+attendanceBuffer = WriteBehindBuffer(
+	flushAttendances,
+	max_batch=MAX_ATTENDANCE_BATCH,
+	flush_interval=int(os.getenv("ATTENDANCE_FLUSH_INTERVAL_MS", "200")) / 1000,
+	capacity=int(os.getenv("ATTENDANCE_BUFFER_CAPACITY", "5000")),
+	drain_timeout=float(os.getenv("ATTENDANCE_DRAIN_TIMEOUT_SECONDS", "10")),
+) if ATTENDANCE_WRITE_BEHIND else None
+# Buffered check-ins that could not be written before shutdown, replayed on the next start
+ATTENDANCE_BUFFER_SPOOL_PATH = os.getenv("ATTENDANCE_BUFFER_SPOOL_PATH", "attendance_buffer_spool.sqlite3")
+
+def replaySpooledAttendances() -> None:
+	if not os.path.exists(ATTENDANCE_BUFFER_SPOOL_PATH):
+		return
+	spool = AttendanceSpool(ATTENDANCE_BUFFER_SPOOL_PATH)
+	try:
+		while True:
+			pending = spool.pending(MAX_ATTENDANCE_BATCH)
+			if not pending:
+				break
+			flushAttendances({
+				attendanceDocId(attendeeId, datetime.fromtimestamp(timestamp, tz=timezone.utc).date()): { "attendee_id": attendeeId, "timestamp": timestamp }
+				for attendeeId, timestamp in pending
+			})
+			for attendeeId, timestamp in pending:
+				spool.remove(attendeeId, timestamp)
+			print(f"Write-behind: replayed {len(pending)} attendances spooled at the last shutdown")
+	except Exception as e:
+		# Whatever is left stays spooled for the next start
+		print(f"Write-behind: could not replay spooled attendances: {e}")
+	finally:
+		spool.close()
+
+def spoolAttendances(attendances: dict[str, dict]) -> None:
+	spool = AttendanceSpool(ATTENDANCE_BUFFER_SPOOL_PATH)
+	try:
+		for attendance in attendances.values():
+			spool.add(attendance["attendee_id"], attendance["timestamp"])
+	finally:
+		spool.close()
+
+# Handlers declared with plain `def` run in this bounded thread pool, so blocking
+# Firestore / Firebase Auth calls never stall the event loop
+BLOCKING_IO_THREADS = int(os.getenv("BLOCKING_IO_THREADS", "40"))
+
+@app.on_event("startup")
+async def ConfigureBlockingPool():
+	anyio.to_thread.current_default_thread_limiter().total_tokens = BLOCKING_IO_THREADS
+
+@app.on_event("startup")
+async def StartRollupCounter():
+	rollupCounter.start()
+
+@app.on_event("startup")
+async def StartAttendanceBuffer():
+	if attendanceBuffer is not None:
+		await run_in_threadpool(replaySpooledAttendances)
+		attendanceBuffer.start()
+
+@app.on_event("shutdown")
+async def DrainAttendanceBuffer():
+	if attendanceBuffer is None:
+		return
+	# Bounded, so an unreachable Firestore cannot hang shutdown; the rest goes to the spool
+	unflushed = await attendanceBuffer.drain()
+	if unflushed:
+		await run_in_threadpool(spoolAttendances, unflushed)
+		print(f"Write-behind: spooled {len(unflushed)} unwritten attendances to {ATTENDANCE_BUFFER_SPOOL_PATH}")
+
+@app.on_event("shutdown")
+async def StopRollupCounter():
+	# Declared after the buffer drain (shutdown handlers run in order), so the drained check-ins are counted too
+	await run_in_threadpool(rollupCounter.stop)
+
+async def recordAttendance(attendance: Attendance) -> dict:
+	"""Records one check-in (buffered in write-behind mode) and returns it; raises HTTPException if it is rejected."""
 	attendeeId = attendance.attendee_id
 	if not attendeeId:
 		raise HTTPException(status_code=400, detail="attendeeId is required in the request body")
@@ -80,43 +250,164 @@ async def Attend(attendance: Attendance):
 
 	# Convert timestamp to UTC date (year, month, day)
 	attendanceDate = datetime.fromtimestamp(timestamp, tz=timezone.utc).date()
-	startOfToday = int(datetime(attendanceDate.year, attendanceDate.month, attendanceDate.day, tzinfo=timezone.utc).timestamp())
-	endOfToday = int(datetime(attendanceDate.year, attendanceDate.month, attendanceDate.day, 23, 59, 59, tzinfo=timezone.utc).timestamp())
 
-	# Check if there's attendance of the student in the current day
-	existedAttendance = (
-		db.collection("attendances") \
-		.where(filter=FieldFilter("attendee_id", "==", attendeeId)) \
-		.where(filter=FieldFilter("timestamp", ">=", startOfToday)) \
-		.where(filter=FieldFilter("timestamp", "<=", endOfToday)) \
-		.stream()
-	)
-
-	if existedAttendance is not None and len(list(existedAttendance)) > 0:
+	# Fast rejection for students already seen today by this process (may seed the day from Firestore)
+	if await run_in_threadpool(attendanceLog.seen, attendeeId, attendanceDate):
 		raise HTTPException(status_code=400, detail="The student is already attended for today")
 
-	# attendanceDict = {
-	# 	"attendee_id": attendeeId,
-	# 	"timestamp": timestamp,
-	# }
-	# attendanceData = Attendance(
-	# 	attendee_id=attendeeId,
-	# 	timestamp=timestamp
-	# )
 	attendance.timestamp = timestamp
 	attendanceDict = attendance.model_dump()
 
-	attendanceRef = db.collection("attendances").document()
-	attendanceRef.set(attendanceDict)
+	if attendanceBuffer is not None:
+		# Remember the check-in before buffering so a concurrent duplicate is rejected right away
+		await run_in_threadpool(attendanceLog.add, attendeeId, attendanceDate, timestamp)
+		try:
+			await attendanceBuffer.put(attendanceDocId(attendeeId, attendanceDate), attendanceDict)
+		except BufferFullError as e:
+			await run_in_threadpool(attendanceLog.discard, attendeeId, attendanceDate)
+			raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+		return attendanceDict
+
+	# The create fails if the student's document for that day already exists
+	try:
+		await run_in_threadpool(createAttendance, attendanceDocId(attendeeId, attendanceDate), attendanceDict)
+	except (AlreadyExists, FailedPrecondition):
+		await run_in_threadpool(attendanceLog.add, attendeeId, attendanceDate, timestamp)
+		raise HTTPException(status_code=400, detail="The student is already attended for today")
+	await run_in_threadpool(attendanceLog.add, attendeeId, attendanceDate, timestamp)
+	return attendanceDict
 
+# Receive and save attendance data from face recognition
+# (async so write-behind mode can await the buffer; blocking calls are offloaded explicitly)
+@app.post("/attendances/", status_code=status.HTTP_201_CREATED)
+async def Attend(attendance: Attendance):
+	attendanceDict = await recordAttendance(attendance)
 	return {
-		"message": "Attendance recorded successfully",
+		"message": "Attendance accepted" if attendanceBuffer is not None else "Attendance recorded successfully",
 		"data": attendanceDict
 	}
 
+# Server-side recognition for devices too small to run dlib: detection and
+# encoding run in a process pool shared by every request, matching against the
+# in-memory gallery of registered encodings
+RECOGNITION_PROCESSES = int(os.getenv("RECOGNITION_PROCESSES", str(max(1, (os.cpu_count() or 2) - 1))))
+RECOGNITION_TOLERANCE = float(os.getenv("RECOGNITION_TOLERANCE", "0.45"))
+MAX_RECOGNITION_UPLOAD_BYTES = 4 * 1024 * 1024
+# Room for the multipart boundaries and the crop/record fields around the image
+MAX_RECOGNITION_FORM_OVERHEAD = 16 * 1024
+
+# Rejected before FastAPI parses (and spools) the multipart body
+app.add_middleware(
+	BodySizeLimitMiddleware,
+	limits={ "/recognitions/": MAX_RECOGNITION_UPLOAD_BYTES + MAX_RECOGNITION_FORM_OVERHEAD }
+)
+
+def matchFaces(encodings: list) -> list:
+	return galleryStore.matcher().match(encodings, RECOGNITION_TOLERANCE)
+
+recognitionEngine = RecognitionEngine(
+	matchFaces,
+	processes=RECOGNITION_PROCESSES,
+	max_batch=int(os.getenv("RECOGNITION_MAX_BATCH", "32")),
+	max_wait=int(os.getenv("RECOGNITION_MAX_WAIT_MS", "20")) / 1000,
+)
+
+@app.on_event("startup")
+async def StartRecognitionEngine():
+	recognitionEngine.start()
+
+@app.on_event("shutdown")
+async def StopRecognitionEngine():
+	recognitionEngine.close()
+
+# Recognize the faces of one JPEG/PNG frame (or a single face crop with `crop`),
+# optionally recording attendance of every recognized student
+@app.post("/recognitions/", status_code=status.HTTP_200_OK)
+async def Recognize(image: UploadFile = File(...), crop: bool = Form(False), record: bool = Form(False)):
+	# Oversized bodies were already rejected by BodySizeLimitMiddleware; still never read more than the limit
+	data = await image.read(MAX_RECOGNITION_UPLOAD_BYTES + 1)
+	if len(data) > MAX_RECOGNITION_UPLOAD_BYTES:
+		raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Image is too large")
+
+	try:
+		faces = await recognitionEngine.recognize(data, crop)
+	except ValueError as e:
+		raise HTTPException(status_code=400, detail=str(e))
+
+	result = []
+	for (top, right, bottom, left), faceMatch in faces:
+		item = {
+			"box": { "top": top, "right": right, "bottom": bottom, "left": left },
+			"attendee_id": faceMatch.name,
+			"distance": faceMatch.distance if faceMatch.distance != float("inf") else None,
+			"attendance": None,
+		}
+		if record and faceMatch.name is not None:
+			try:
+				await recordAttendance(Attendance(attendee_id=faceMatch.name))
+				item["attendance"] = "created"
+			except HTTPException as e:
+				item["attendance"] = "already_attended" if e.status_code == 400 else "unavailable"
+		result.append(item)
+
+	return {
+		"message": "Frame recognized successfully",
+		"data": result
+	}
+
+# Receive and save many attendances in one request (group check-ins, offline replays)
+@app.post("/attendances/batch/", status_code=status.HTTP_200_OK)
+def AttendBatch(attendances: list[Attendance]):
+	if len(attendances) > MAX_ATTENDANCE_BATCH:
+		raise HTTPException(status_code=400, detail=f"At most {MAX_ATTENDANCE_BATCH} attendances are accepted per batch")
+
+	now = int(datetime.now(tz=timezone.utc).timestamp())
+	result = []
+	pending = {} # document id -> index in result of the check-in to write
+
+	for attendance in attendances:
+		timestamp = attendance.timestamp or now
+		item = { "attendee_id": attendance.attendee_id, "timestamp": timestamp, "status": "invalid" }
+		result.append(item)
+		if not attendance.attendee_id:
+			continue
+
+		attendanceDate = datetime.fromtimestamp(timestamp, tz=timezone.utc).date()
+		if attendanceLog.seen(attendance.attendee_id, attendanceDate):
+			item["status"] = "already_attended"
+			continue
+
+		# Within the batch, the earliest check-in of a student per day wins
+		docId = attendanceDocId(attendance.attendee_id, attendanceDate)
+		if docId in pending:
+			first = result[pending[docId]]
+			if timestamp >= first["timestamp"]:
+				item["status"] = "already_attended"
+				continue
+			first["status"] = "already_attended"
+		item["status"] = "pending"
+		pending[docId] = len(result) - 1
+
+	if pending:
+		statuses = writeAttendances({
+			docId: { "attendee_id": result[index]["attendee_id"], "timestamp": result[index]["timestamp"] }
+			for docId, index in pending.items()
+		})
+		for docId, index in pending.items():
+			result[index]["status"] = statuses[docId]
+
+		for index in pending.values():
+			item = result[index]
+			attendanceLog.add(item["attendee_id"], datetime.fromtimestamp(item["timestamp"], tz=timezone.utc).date(), item["timestamp"])
+
+	return {
+		"message": "Attendance batch processed",
+		"data": result
+	}
+
 # Student registration
 @app.post("/students/", status_code=status.HTTP_201_CREATED)
-async def Register(student: Student):
+def Register(student: Student):
 	studentDict = student.model_dump()
 
 	# Email and password are mandatory for Firebase Auth
@@ -137,24 +428,26 @@ async def Register(student: Student):
 	if existingStudent.exists:
 		raise HTTPException(status_code=400, detail="Student already exists")
 
+	encoding = None
+	imageVersion = thumbnailVersion = None
 	if student.image:
 		if not student.image.content_type in ["image/jpeg", "image/jpg", "image/png"]:
 			raise HTTPException(status_code=400, detail="Only .jpg and .png files are supported")
+
+		# Encode the face once here so recognition clients never have to
+		try:
+			image = load_enrollment_image(student.image.file)
+		except Exception as e:
+			raise HTTPException(status_code=400, detail=f"Could not read image: {str(e)}")
+		faceLocations = face_recognition.face_locations(image)
+		if len(faceLocations) != 1:
+			raise HTTPException(status_code=400, detail=f"The photo must contain exactly one face, found {len(faceLocations)}")
+		encoding = face_recognition.face_encodings(image, faceLocations)[0]
+
 		try:
-			# Define the folder to save files
-			UPLOAD_DIR = "faces"
-			os.makedirs(UPLOAD_DIR, exist_ok=True) # Create folder if it doesn't exist
-
-			# Create a unique filename
-			file_extension = student.image.filename.split('.')[-1]
-			unique_filename = f"{studentId}.{file_extension}"
-			file_location = os.path.join(UPLOAD_DIR, unique_filename)
-			
-			# Save the file to the specified folder
-			with open(file_location, "wb+") as file_object:
-				shutil.copyfileobj(student.image.file, file_object)
-			
-			print(f"File saved locally at: {file_location}")
+			# Only the face-centered, downscaled photo and its thumbnail are kept
+			imageVersion, thumbnailVersion = save_enrollment_image(crop_face(image, faceLocations[0]), FACES_DIR, studentId)
+			print(f"File saved locally at: {os.path.join(FACES_DIR, studentId)}.jpg")
 		except Exception as e:
 			raise HTTPException(status_code=500, detail=f"Error saving image: {str(e)}")
 	
@@ -173,20 +466,31 @@ async def Register(student: Student):
 		"first_name": studentDict["first_name"],
 		"last_name": studentDict["last_name"],
 	}
+	if encoding is not None:
+		studentName["encoding"] = encoding_to_bytes(encoding)
+		studentName["image_version"] = imageVersion
+		studentName["thumbnail_version"] = thumbnailVersion
+	# Lets recognition clients pick the student up in their next delta sync
+	studentName["updated_at"] = nowMillis()
 	
 	studentRef = db.collection("students").document(studentId)
-	studentRef.set(studentName)
+	batch = db.batch()
+	batch.set(studentRef, studentName)
+	batch.delete(db.collection(STUDENT_DELETIONS_COLLECTION).document(studentId))
+	batch.commit()
+	studentDirectory.invalidate(studentId)
+	galleryStore.invalidate()
 
 	return { "message": "Student registered successfully" }
 
 # Login (for instructor)
 @app.post("/instructors/", status_code=status.HTTP_200_OK)
-async def Login(instructor: Instructor):
+def Login(instructor: Instructor):
 	if (instructor.email is None) or (instructor.password is None):
 		raise HTTPException(status_code=400, detail="Email and password are required for login")
 
 	try:
-		auth.get_user_by_email(instructor.email)
+		userRecord = auth.get_user_by_email(instructor.email)
 	except auth.UserNotFoundError:
 		raise HTTPException(status_code=404, detail="User not found")
 	except Exception as e:
@@ -210,6 +514,8 @@ async def Login(instructor: Instructor):
 	}
 
 	token = jwt.encode(tokenPayload, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
+	# The record was just fetched, so the first authenticated request needs no Firebase lookup
+	verified_users.put(instructorDoc.id, instructor.email, userRecord)
 
 	instructorDict = instructorDoc.to_dict()
 	instructor = Instructor(
@@ -226,7 +532,7 @@ async def Login(instructor: Instructor):
 
 # Remove a student from Firebase (instructor access)
 @app.delete("/students/{studentId}", status_code=status.HTTP_200_OK)
-async def Remove(studentId: str):
+def Remove(studentId: str):
 	if not studentId:
 		raise HTTPException(status_code=400, detail="ID of a student is required for removal")
 
@@ -235,6 +541,7 @@ async def Remove(studentId: str):
 		uid = auth.get_user_by_email(f"{studentId}" + VALID_EMAIL_DOMAIN).uid
 		# print("Deleting user with UID:", uid)
 		auth.delete_user(uid)
+		verified_users.invalidate(uid=uid)
 	except auth.UserNotFoundError:
 		raise HTTPException(status_code=404, detail="User not found")
 	except Exception as e:
@@ -244,7 +551,7 @@ async def Remove(studentId: str):
 	transaction = db.transaction()
 
 	# Retrieve all attendance documents for the student
-	attendanceQuery = db.collection("attendances").where("student_id", "==", studentId).stream()
+	attendanceQuery = db.collection("attendances").where(filter=FieldFilter("attendee_id", "==", studentId)).stream()
 	attendanceDocs = [doc for doc in attendanceQuery]
 
 	# Use the transaction to delete each attendance document
@@ -254,32 +561,39 @@ async def Remove(studentId: str):
 	# Delete the student document
 	studentRef = db.collection("students").document(studentId)
 	transaction.delete(studentRef)
+	# Tombstone so recognition clients drop the student in their next delta sync
+	transaction.set(db.collection(STUDENT_DELETIONS_COLLECTION).document(studentId), { "deleted_at": nowMillis() })
 
 	# Commit the transaction
 	transaction.commit()
+	# Take the deleted check-ins back out of the insight rollups
+	timestamps = [doc.to_dict().get("timestamp") for doc in attendanceDocs]
+	rollupCounter.add([timestamp for timestamp in timestamps if type(timestamp) is int], step=-1)
+	studentDirectory.invalidate(studentId)
+	galleryStore.invalidate()
+	attendanceLog.forget(studentId)
 
 	return { "message": "Student and their attendances deleted successfully" }
 
-# Retrieve attendees in the current day/class sorted descendingly by timestamp
-@app.get("/attendances/", status_code=status.HTTP_200_OK)
-async def GetAttendances(recent: bool = Query(False)):
-	now = datetime.now(timezone.utc)
-	startOfToday = int(datetime(now.year, now.month, now.day, tzinfo=timezone.utc).timestamp())
-	endOfToday = int(datetime(now.year, now.month, now.day, 23, 59, 59, tzinfo=timezone.utc).timestamp())
-	docs = (db.collection("attendances") \
-		.where(filter=FieldFilter("timestamp", ">=", startOfToday)) \
-		.where(filter=FieldFilter("timestamp", "<=", endOfToday)) \
-		.order_by("timestamp", direction=firestore.Query.DESCENDING) \
+def parseCursor(cursor: str | None, length: int) -> list | None:
+	if cursor is None:
+		return None
+	try:
+		values = decode_cursor(cursor)
+	except ValueError as e:
+		raise HTTPException(status_code=400, detail=str(e))
+	if len(values) != length:
+		raise HTTPException(status_code=400, detail="Invalid cursor")
+	return values
+
+def joinStudentNames(attendances: list[dict]) -> list[dict]:
+	# Join student names in memory; uncached students are fetched in one batch
+	students = studentDirectory.get_many(
+		{attendance["attendee_id"] for attendance in attendances if "attendee_id" in attendance}
 	)
-	if recent:
-		docs = docs.limit(5)
-	docs = docs.stream()
-
 
 	result = []
-	for doc in docs:
-		attendance = doc.to_dict()
-
+	for attendance in attendances:
 		if type(attendance["timestamp"]) is not int:
 			attendance["timestamp"] = 0
 		
@@ -288,10 +602,8 @@ async def GetAttendances(recent: bool = Query(False)):
 			attendance["last_name"] = "Unknown"
 			attendance["attendee_id"] = "Unknown"
 		else:
-			studentRef = db.collection("students").document(attendance["attendee_id"])
-			studentDoc = studentRef.get()
-			if studentDoc.exists:
-				student = studentDoc.to_dict()
+			student = students.get(attendance["attendee_id"])
+			if student is not None:
 				attendance["first_name"] = student["first_name"]
 				attendance["last_name"] = student["last_name"]
 			else:
@@ -301,47 +613,145 @@ async def GetAttendances(recent: bool = Query(False)):
 		doc = Attendee(**attendance)
 		docDict = doc.model_dump()
 		result.append(docDict)
-	
-	return {
-		"message": "Today's attendances retrieved successfully",
-		"data": result
-	}
+	return result
 
-# Retrieve list of all students registered in the class
-@app.get("/students/", status_code=status.HTTP_200_OK)
-async def GetStudents(head: bool = Query(True), search: str = Query(None)):
+def attendancePages(pageSize: int, startAfter: list | None = None, maxItems: int | None = None):
+	"""Yields (attendees, nextCursor) pages of today's attendances, newest first."""
 	now = datetime.now(timezone.utc)
 	startOfToday = int(datetime(now.year, now.month, now.day, tzinfo=timezone.utc).timestamp())
 	endOfToday = int(datetime(now.year, now.month, now.day, 23, 59, 59, tzinfo=timezone.utc).timestamp())
+	query = db.collection("attendances") \
+		.where(filter=FieldFilter("timestamp", ">=", startOfToday)) \
+		.where(filter=FieldFilter("timestamp", "<=", endOfToday)) \
+		.order_by("timestamp", direction=firestore.Query.DESCENDING) \
+		.order_by("__name__", direction=firestore.Query.DESCENDING)
+
+	while maxItems is None or maxItems > 0:
+		size = pageSize if maxItems is None else min(pageSize, maxItems)
+		page = query
+		if startAfter is not None:
+			page = page.start_after({ "timestamp": startAfter[0], "__name__": startAfter[1] })
+		# One extra document tells whether another page exists
+		docs = list(page.limit(size + 1).stream())
+		hasMore = len(docs) > size
+		docs = docs[:size]
+		if maxItems is not None:
+			maxItems -= len(docs)
+
+		nextCursor = None
+		if hasMore and docs:
+			startAfter = [docs[-1].get("timestamp"), docs[-1].id]
+			nextCursor = encode_cursor(startAfter)
+		yield joinStudentNames([doc.to_dict() for doc in docs]), nextCursor
+		if nextCursor is None:
+			break
 
-	students = (db.collection("students"))
-	if head:
-		students = students.limit(5)
-	students = students.stream()
+# Retrieve attendees in the current day/class sorted descendingly by timestamp
+# (whole day by default; one page with `limit`/`start_after`, or every page as NDJSON with `stream`)
+@app.get("/attendances/", status_code=status.HTTP_200_OK)
+def GetAttendances(
+	recent: bool = Query(False),
+	limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+	start_after: str | None = Query(None),
+	stream: bool = Query(False),
+):
+	startAfter = parseCursor(start_after, 2)
+	if stream:
+		pages = attendancePages(limit or DEFAULT_PAGE_SIZE, startAfter)
+		return StreamingResponse(ndjson_lines(pages), media_type="application/x-ndjson")
+
+	if limit is not None or startAfter is not None:
+		result, nextCursor = next(attendancePages(limit or DEFAULT_PAGE_SIZE, startAfter))
+		return {
+			"message": "Page of today's attendances retrieved successfully",
+			"data": result,
+			"next_cursor": nextCursor
+		}
 
 	result = []
-	for student in students:
-		studentDict = student.to_dict()
-		studentDict["attendee_id"] = str(student.id)
+	for attendees, _ in attendancePages(MAX_PAGE_SIZE, maxItems=5 if recent else None):
+		result.extend(attendees)
+	
+	return {
+		"message": "Today's attendances retrieved successfully",
+		"data": result
+	}
 
-		attendances = list(db.collection("attendances") \
-			.where(filter=FieldFilter("attendee_id", "==", str(student.id))) \
-			.where(filter=FieldFilter("timestamp", ">=", startOfToday)) \
-			.where(filter=FieldFilter("timestamp", "<=", endOfToday)) \
-			.limit(1) \
-			.stream()
-		)
-		attendance = attendances[0] if attendances else None
+def studentPages(pageSize: int, startAfter: list | None = None, maxItems: int | None = None):
+	"""Yields (students with today's attending time, nextCursor) pages ordered by student id."""
+	today = datetime.now(timezone.utc).date()
+	query = db.collection("students").order_by("__name__")
+
+	while maxItems is None or maxItems > 0:
+		size = pageSize if maxItems is None else min(pageSize, maxItems)
+		page = query
+		if startAfter is not None:
+			page = page.start_after({ "__name__": startAfter[0] })
+		docs = list(page.limit(size + 1).stream())
+		hasMore = len(docs) > size
+		students = docs[:size]
+		if maxItems is not None:
+			maxItems -= len(students)
+
+		# Today's attendances of the page are addressed by id, so they come back in one round-trip
+		attendedAt = {}
+		if students:
+			refs = [db.collection("attendances").document(attendanceDocId(student.id, today)) for student in students]
+			for attendance in db.get_all(refs, field_paths=["attendee_id", "timestamp"]):
+				if attendance.exists:
+					attendanceDict = attendance.to_dict()
+					attendedAt[attendanceDict.get("attendee_id")] = attendanceDict.get("timestamp", 0)
+			# Check-ins written before per-day ids (random document ids) are only found by
+			# today's date-range query, which the attendance log runs once per day and caches
+			for student in students:
+				if student.id not in attendedAt:
+					timestamp = attendanceLog.timestamp(student.id, today)
+					if timestamp is not None:
+						attendedAt[student.id] = timestamp
+
+		result = []
+		for student in students:
+			studentDict = student.to_dict()
+			studentDict["attendee_id"] = str(student.id)
+			studentDict["timestamp"] = attendedAt.get(str(student.id), 0)
+
+			student = Attendee(**studentDict)
+			studentDict = student.model_dump()
+			result.append(studentDict)
+
+		nextCursor = encode_cursor([students[-1].id]) if hasMore and students else None
+		if nextCursor is not None:
+			startAfter = [students[-1].id]
+		yield result, nextCursor
+		if nextCursor is None:
+			break
 
-		if attendance is not None:
-			attendanceDict = attendance.to_dict()
-			studentDict["timestamp"] = attendanceDict["timestamp"]
-		else:
-			studentDict["timestamp"] = 0
+# Retrieve list of all students registered in the class
+# (`head` for the first five; one page with `limit`/`start_after`, or every page as NDJSON with `stream`)
+@app.get("/students/", status_code=status.HTTP_200_OK)
+def GetStudents(
+	head: bool = Query(True),
+	search: str = Query(None),
+	limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+	start_after: str | None = Query(None),
+	stream: bool = Query(False),
+):
+	startAfter = parseCursor(start_after, 1)
+	if stream:
+		pages = studentPages(limit or DEFAULT_PAGE_SIZE, startAfter)
+		return StreamingResponse(ndjson_lines(pages), media_type="application/x-ndjson")
+
+	if limit is not None or startAfter is not None:
+		result, nextCursor = next(studentPages(limit or DEFAULT_PAGE_SIZE, startAfter))
+		return {
+			"message": "Page of students and their attending time retrieved successfully",
+			"data": result,
+			"next_cursor": nextCursor
+		}
 
-		student = Attendee(**studentDict)
-		studentDict = student.model_dump()
-		result.append(studentDict)
+	result = []
+	for students, _ in studentPages(MAX_PAGE_SIZE, maxItems=5 if head else None):
+		result.extend(students)
 
 	if search:
 		pass
@@ -376,31 +786,121 @@ async def GetStudents(head: bool = Query(True), search: str = Query(None)):
 		"data": result
 	}
 
-# --- 1. แก้ไขและตั้งค่า Static Files ให้ถูกต้อง ---
-# สร้างโฟลเดอร์ชื่อ 'public_uploads' ในโปรเจกต์ของคุณ
-# ถ้ามี request มาที่ URL /uploaded_images/... ให้ไปหาไฟล์ในโฟลเดอร์ public_uploads
-app.mount("/faces", StaticFiles(directory="faces"), name="static")
+# Changes are selected a few seconds before `since`, so writes committed around the previous call are not missed
+STUDENT_CHANGES_OVERLAP_MS = 5000
+
+# Students added, updated or removed since a recognition client's last sync
+# (`since` = the `version` returned by the previous call; 0 for everything)
+@app.get("/students/changes/", status_code=status.HTTP_200_OK)
+def GetStudentChanges(since: int = Query(0, ge=0), encodings: bool = Query(True)):
+	version = nowMillis()
+	students = db.collection("students")
+	if since > 0:
+		students = students.where(filter=FieldFilter("updated_at", ">=", since - STUDENT_CHANGES_OVERLAP_MS))
+
+	images = { os.path.splitext(f)[0]: f for f in os.listdir(FACES_DIR) if os.path.isfile(os.path.join(FACES_DIR, f)) }
+	upserted = []
+	for student in students.stream():
+		studentDict = student.to_dict()
+		encoding = studentDict.get("encoding")
+		imageUrl = thumbnailUrl = None
+		if student.id in images:
+			# Versioned URLs change with the photo, so clients may cache them forever
+			# Each variant carries its own content version, the one its ETag is compared with
+			imageQuery = f"?v={studentDict['image_version']}" if studentDict.get("image_version") else ""
+			imageUrl = f"/faces/{images[student.id]}{imageQuery}"
+			if os.path.isfile(os.path.join(FACES_DIR, "thumbs", images[student.id])):
+				thumbnailQuery = f"?v={studentDict['thumbnail_version']}" if studentDict.get("thumbnail_version") else ""
+				thumbnailUrl = f"/faces/thumbs/{images[student.id]}{thumbnailQuery}"
+		upserted.append({
+			"attendee_id": student.id,
+			"first_name": studentDict.get("first_name", "Unknown"),
+			"last_name": studentDict.get("last_name", "Unknown"),
+			"image_url": imageUrl,
+			"thumbnail_url": thumbnailUrl,
+			"encoding": base64.b64encode(encoding).decode() if encodings and isinstance(encoding, bytes) else None,
+		})
+
+	deleted = []
+	if since > 0:
+		tombstones = db.collection(STUDENT_DELETIONS_COLLECTION) \
+			.where(filter=FieldFilter("deleted_at", ">=", since - STUDENT_CHANGES_OVERLAP_MS)) \
+			.stream()
+		deleted = [tombstone.id for tombstone in tombstones]
 
-# Get all attendance records from the start of the week
+	return {
+		"message": "Student changes retrieved successfully",
+		"data": {
+			"version": version,
+			"upserted": upserted,
+			"deleted": deleted
+		}
+	}
+
+# Every registered encoding as one packed blob (see gallery.pack_gallery) for kiosk cold starts
+@app.get("/gallery/", status_code=status.HTTP_200_OK)
+def GetGallery(if_none_match: str | None = Header(None)):
+	blob, etag = galleryStore.packed()
+	headers = { "ETag": etag, "Cache-Control": "no-cache" }
+	if if_none_match is not None and etag in [tag.strip() for tag in if_none_match.split(",")]:
+		return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+	return Response(content=blob, media_type="application/octet-stream", headers=headers)
+
+# Enrollment photos and thumbnails with content-hash ETags; a URL carrying the
+# current version (?v=, as returned by /students/changes/) may be cached forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, max-age=300, must-revalidate"
+
+def enrollmentImageResponse(directory: str, filename: str, version: str | None, ifNoneMatch: str | None):
+	path = os.path.join(directory, filename)
+	if filename != os.path.basename(filename) or filename.startswith(".") or not os.path.isfile(path):
+		raise HTTPException(status_code=404, detail="Image not found")
+
+	etag = file_etag(path)
+	headers = {
+		"ETag": etag,
+		"Cache-Control": IMMUTABLE_CACHE_CONTROL if version == etag.strip('"') else REVALIDATE_CACHE_CONTROL,
+	}
+	if ifNoneMatch is not None and etag in [tag.strip() for tag in ifNoneMatch.split(",")]:
+		return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+	return FileResponse(path, headers=headers)
+
+@app.get("/faces/thumbs/{filename}")
+def GetFaceThumbnail(filename: str, v: str | None = Query(None), if_none_match: str | None = Header(None)):
+	return enrollmentImageResponse(os.path.join(FACES_DIR, "thumbs"), filename, v, if_none_match)
+
+@app.get("/faces/{filename}")
+def GetFace(filename: str, v: str | None = Query(None), if_none_match: str | None = Header(None)):
+	return enrollmentImageResponse(FACES_DIR, filename, v, if_none_match)
+
+# Attendance counts of the current week, pre-aggregated per 15-minute bucket, hour and day (UTC)
 @app.get("/insights/")
-async def GetAttendancesThisWeek():
+def GetAttendancesThisWeek():
 	try:
-		now = datetime.now(tz=timezone.utc)
-		startOfTheWeek = int((now - timedelta(days=now.weekday())).replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
-		endOfTheWeek = int((now + timedelta(days=6 - now.weekday())).replace(hour=23, minute=59, second=59, microsecond=999999).timestamp())
-
-		attendancesThisWeek = (db.collection("attendances") \
-			.select(["timestamp"]) \
-			.where(filter=FieldFilter("timestamp", ">=", startOfTheWeek)) \
-			.where(filter=FieldFilter("timestamp", "<=", endOfTheWeek)) \
-			.order_by("timestamp", direction=firestore.Query.DESCENDING) \
-			.stream() \
-		)
-		attendances = list(attendance.to_dict()["timestamp"] for attendance in attendancesThisWeek)
+		days = week_days(datetime.now(tz=timezone.utc))
+		rollups = load_rollups(db, days)
+
+		buckets, hours, dailyCounts = [], {}, []
+		for day in days:
+			startOfDay = start_of_day(day)
+			rollup = rollups[day]
+			for bucket, count in sorted(rollup.get("buckets", {}).items(), key=lambda item: int(item[0])):
+				if count <= 0:
+					continue
+				timestamp = startOfDay + int(bucket) * BUCKET_SECONDS
+				buckets.append({ "timestamp": timestamp, "count": count })
+				hour = timestamp - timestamp % 3600
+				hours[hour] = hours.get(hour, 0) + count
+			dailyCounts.append({ "date": day.isoformat(), "count": rollup.get("total", 0) })
 
 		return {
-			"message": "Attendances from the start of the week retrieved successfully",
-			"data": attendances
+			"message": "Attendance counts from the start of the week retrieved successfully",
+			"data": {
+				"bucket_seconds": BUCKET_SECONDS,
+				"buckets": buckets,
+				"hours": [{ "timestamp": hour, "count": count } for hour, count in hours.items()],
+				"days": dailyCounts,
+			}
 		}
 
 	except Exception as e:
@@ -0,0 +1,53 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# ==============================================================================
+# --- MOTION GATE ---
+# ==============================================================================
+# A cheap background-difference check on a tiny grayscale copy of each frame.
+# Face detection only runs while the scene changes (plus a short hold time), or
+# while faces are still in view, so an empty doorway keeps the CPU idle.
+
+
+class MotionGate:
+    """ Decides per frame whether detection is worth running. Thread-safe. """
+
+    def __init__(self, width: int = 160, pixel_threshold: int = 25, min_changed_ratio: float = 0.002,
+                 hold_seconds: float = 2.0, learning_rate: float = 0.05):
+        self.width = width
+        self.pixel_threshold = pixel_threshold
+        self.min_changed_ratio = min_changed_ratio
+        self.hold_seconds = hold_seconds
+        self.learning_rate = learning_rate
+        self.background = None
+        self.last_active = 0.0
+        self.lock = threading.Lock()
+
+    def check(self, frame) -> bool:
+        """ Updates the background model and returns True if detection should run on ``frame``. """
+        h, w = frame.shape[:2]
+        small = cv2.resize(frame, (self.width, max(1, h * self.width // w)), interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        now = time.time()
+
+        with self.lock:
+            if self.background is None or self.background.shape != gray.shape:
+                self.background = gray.astype(np.float32)
+                self.last_active = now
+                return True
+
+            diff = cv2.absdiff(gray, cv2.convertScaleAbs(self.background))
+            changed_ratio = np.count_nonzero(diff > self.pixel_threshold) / diff.size
+            cv2.accumulateWeighted(gray, self.background, self.learning_rate)
+
+            if changed_ratio >= self.min_changed_ratio:
+                self.last_active = now
+            return now - self.last_active <= self.hold_seconds
+
+    def keep_awake(self) -> None:
+        """ Keeps detection running, e.g. while faces are in view but standing still. """
+        with self.lock:
+            self.last_active = time.time()
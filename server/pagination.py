@@ -0,0 +1,32 @@
+import base64
+import json
+from typing import Any
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(values: list[Any]) -> str:
+    """ Packs the sort key of the last returned document into an opaque, URL-safe cursor. """
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list[Any]:
+    """ Inverse of ``encode_cursor``; raises ValueError for anything it did not produce. """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def ndjson_lines(pages):
+    """ Turns an iterator of ``(items, next_cursor)`` pages into NDJSON lines, one item per line. """
+    for items, _ in pages:
+        for item in items:
+            yield json.dumps(item, ensure_ascii=False) + "\n"
@@ -0,0 +1,129 @@
+import asyncio
+import io
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Callable, List, Optional, Sequence, Set, Tuple
+
+import face_recognition
+import numpy as np
+from PIL import Image, ImageOps
+
+from gallery import FaceMatch
+
+Location = Tuple[int, int, int, int]  # (top, right, bottom, left)
+
+
+def encode_images(images: Sequence[Tuple[bytes, bool]], max_side: int) -> list:
+    """
+    Runs in a worker process: decodes each ``(jpeg bytes, is_face_crop)`` and
+    returns ``("ok", [(location, encoding)])`` or ``("error", message)`` per
+    image, with locations in the coordinates of the uploaded image.
+    """
+    results = []
+    for data, is_crop in images:
+        try:
+            image = ImageOps.exif_transpose(Image.open(io.BytesIO(data))).convert("RGB")
+            width = image.width
+            image.thumbnail((max_side, max_side))
+            scale = width / image.width
+            rgb = np.asarray(image)
+        except Exception as e:
+            results.append(("error", f"Could not read image: {e}"))
+            continue
+
+        if is_crop:
+            locations = [(0, rgb.shape[1], rgb.shape[0], 0)]
+        else:
+            locations = face_recognition.face_locations(rgb)
+        encodings = face_recognition.face_encodings(rgb, locations) if locations else []
+        results.append(("ok", [
+            (tuple(int(round(v * scale)) for v in location), encoding)
+            for location, encoding in zip(locations, encodings)
+        ]))
+    return results
+
+
+class RecognitionEngine:
+    """
+    Micro-batches recognition requests from many devices. Requests arriving
+    within ``max_wait`` seconds of each other (up to ``max_batch``) are split
+    across a process pool for detection and encoding, and all their faces are
+    then matched with one vectorized ``match`` call.
+    """
+
+    def __init__(self, match: Callable[[List[np.ndarray]], List[FaceMatch]], processes: int,
+                 max_batch: int = 32, max_wait: float = 0.02, max_side: int = 960):
+        self.match = match
+        self.processes = processes
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_side = max_side
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self.in_flight: Set[asyncio.Task] = set()
+
+    def start(self) -> None:
+        # Spawned, not forked: the server already holds Firestore/gRPC threads and sockets a fork would copy
+        self.executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=get_context("spawn"))
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+
+    def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def recognize(self, data: bytes, is_crop: bool = False) -> List[Tuple[Location, FaceMatch]]:
+        """ Returns ``[(location, FaceMatch)]`` for one image; raises ValueError if it cannot be decoded. """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((data, is_crop, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout=timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Keep collecting the next batch while this one is encoded
+            task = asyncio.create_task(self._process(batch))
+            self.in_flight.add(task)
+            task.add_done_callback(self.in_flight.discard)
+
+    async def _process(self, batch: list) -> None:
+        loop = asyncio.get_running_loop()
+        size = -(-len(batch) // min(self.processes, len(batch)))
+        chunks = [batch[start:start + size] for start in range(0, len(batch), size)]
+        try:
+            encoded = await asyncio.gather(*(
+                loop.run_in_executor(self.executor, encode_images, [(data, is_crop) for data, is_crop, _ in chunk], self.max_side)
+                for chunk in chunks
+            ))
+            results = [result for chunk_results in encoded for result in chunk_results]
+
+            faces = [face for kind, found in results if kind == "ok" for face in found]
+            matches = iter(await asyncio.to_thread(self.match, [encoding for _, encoding in faces]) if faces else [])
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, _, future), (kind, found) in zip(batch, results):
+            recognized = [(location, next(matches)) for location, _ in found] if kind == "ok" else None
+            if future.done():
+                # The client went away; its matches were still consumed above
+                continue
+            if recognized is None:
+                future.set_exception(ValueError(found))
+            else:
+                future.set_result(recognized)
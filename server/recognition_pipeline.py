@@ -0,0 +1,264 @@
+import queue
+import threading
+import time
+from typing import Any, Callable, List, NamedTuple, Optional
+
+# ==============================================================================
+# --- STAGED CAPTURE / RECOGNITION PIPELINE ---
+# ==============================================================================
+# capture thread  -> keeps only the newest frame (older ones are overwritten)
+# recognition workers -> detect + encode + match the newest unprocessed frame,
+#   optionally skipping frames an idle ``gate`` (e.g. MotionGate) rejects
+# render (caller's thread, usually main for cv2.imshow) -> shows the newest
+#   frame and overlays the newest recognition result from a bounded queue.
+# Several cameras can share one worker pool (MultiStreamPipeline); workers then
+# visit the streams round-robin so a busy camera cannot starve the others.
+
+
+class Frame(NamedTuple):
+    frame_id: int
+    image: Any
+    captured_at: float
+
+
+class RecognitionResult(NamedTuple):
+    frame_id: int
+    captured_at: float
+    finished_at: float
+    faces: Any
+
+
+class FrameGrabber:
+    """ Reads a capture device on its own thread and keeps only the latest frame. """
+
+    def __init__(self, cap, read_retry_delay: float = 1, on_frame: Optional[Callable[[], None]] = None):
+        self.cap = cap
+        self.read_retry_delay = read_retry_delay
+        self.on_frame = on_frame
+        self.condition = threading.Condition()
+        self.latest: Optional[Frame] = None
+        self.running = False
+        self.thread = threading.Thread(target=self._run, name="frame-grabber", daemon=True)
+
+    def start(self) -> None:
+        self.running = True
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+        self.thread.join(timeout=2)
+
+    def wait_for(self, after_id: int, timeout: Optional[float] = None) -> Optional[Frame]:
+        """ Blocks until a frame newer than ``after_id`` is available (or timeout/stop). """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: not self.running or (self.latest is not None and self.latest.frame_id > after_id),
+                timeout=timeout,
+            )
+            if self.latest is not None and self.latest.frame_id > after_id:
+                return self.latest
+            return None
+
+    def _run(self) -> None:
+        frame_id = 0
+        while self.running:
+            ret, image = self.cap.read()
+            if not ret:
+                print("Cannot read frame, retrying...")
+                time.sleep(self.read_retry_delay)
+                continue
+            frame_id += 1
+            with self.condition:
+                self.latest = Frame(frame_id, image, time.time())
+                self.condition.notify_all()
+            if self.on_frame is not None:
+                self.on_frame()
+
+
+class StreamStats:
+    """ Capture rate, recognition rate and capture-to-result latency of one stream (moving averages). Thread-safe. """
+
+    def __init__(self, smoothing: float = 0.1):
+        self.smoothing = smoothing
+        self.capture_fps = 0.0
+        self.recognition_fps = 0.0
+        self.latency = 0.0
+        self.last_captured: Optional[float] = None
+        self.last_processed: Optional[float] = None
+        self.lock = threading.Lock()
+
+    def _rate(self, current: float, last: Optional[float], now: float) -> float:
+        if last is None or now <= last:
+            return current
+        return current + self.smoothing * (1.0 / (now - last) - current)
+
+    def captured(self, now: float) -> None:
+        with self.lock:
+            self.capture_fps = self._rate(self.capture_fps, self.last_captured, now)
+            self.last_captured = now
+
+    def processed(self, captured_at: float, now: float) -> None:
+        with self.lock:
+            self.recognition_fps = self._rate(self.recognition_fps, self.last_processed, now)
+            self.last_processed = now
+            self.latency += self.smoothing * ((now - captured_at) - self.latency)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {"capture_fps": self.capture_fps, "recognition_fps": self.recognition_fps, "latency": self.latency}
+
+
+class CameraStream:
+    """
+    One camera of a MultiStreamPipeline: its grabber, ``recognize(image)``,
+    optional idle ``gate``, ``frame_skip``, result queue and stats. With a
+    ``controller`` (any object with a ``frame_skip`` attribute, e.g.
+    AdaptiveController) the stream follows the controller's frame skip instead.
+    """
+
+    def __init__(self, name: str, cap, recognize: Callable[[Any], Any], frame_skip: int = 1,
+                 max_results: int = 4, gate: Optional[Callable[[Any], bool]] = None, controller=None):
+        self.name = name
+        self.grabber = FrameGrabber(cap, on_frame=self._on_frame)
+        self.recognize = recognize
+        self.controller = controller
+        self._frame_skip = frame_skip
+        self.gate = gate
+        self.idle = False
+        self.gated_id = 0  # newest frame whose gate verdict ``idle`` holds; guarded by the pipeline's condition
+        self.results: "queue.Queue[RecognitionResult]" = queue.Queue(maxsize=max_results)
+        self.last_claimed_id = 0
+        self.stats = StreamStats()
+        self.notify: Optional[Callable[[], None]] = None
+
+    @property
+    def frame_skip(self) -> int:
+        return self.controller.frame_skip if self.controller is not None else self._frame_skip
+
+    @frame_skip.setter
+    def frame_skip(self, value: int) -> None:
+        self._frame_skip = value
+
+    def next_frame(self, after_id: int, timeout: float = 1) -> Optional[Frame]:
+        """ Returns the newest frame for display once it is newer than ``after_id``. """
+        return self.grabber.wait_for(after_id, timeout)
+
+    def poll(self) -> List[RecognitionResult]:
+        """ Returns the recognition results finished since the last call, oldest first. """
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                return sorted(results, key=lambda result: result.frame_id)
+
+    def claimable(self) -> Optional[Frame]:
+        # While gated, every new frame is checked so detection resumes on the first frame with motion
+        skip = 1 if self.idle else self.frame_skip
+        frame = self.grabber.latest
+        if frame is not None and frame.frame_id >= self.last_claimed_id + skip:
+            return frame
+        return None
+
+    def _on_frame(self) -> None:
+        self.stats.captured(time.time())
+        if self.notify is not None:
+            self.notify()
+
+
+class MultiStreamPipeline:
+    """
+    Runs the ``recognize`` of every stream on one shared pool of worker
+    threads. Each worker takes the newest claimable frame of the next stream
+    in round-robin order, so cameras get an equal share of the workers no
+    matter how fast they capture.
+    """
+
+    def __init__(self, streams: List[CameraStream], workers: int = 1):
+        self.streams = streams
+        self.condition = threading.Condition()
+        self.cursor = 0
+        self.running = False
+        for stream in streams:
+            stream.notify = self._notify
+        self.workers = [
+            threading.Thread(target=self._work, name=f"recognition-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+
+    def start(self) -> None:
+        self.running = True
+        for stream in self.streams:
+            stream.grabber.start()
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self) -> None:
+        self.running = False
+        self._notify()
+        for stream in self.streams:
+            stream.grabber.stop()
+        for worker in self.workers:
+            worker.join(timeout=2)
+
+    def stats(self) -> dict:
+        return {stream.name: stream.stats.snapshot() for stream in self.streams}
+
+    def _notify(self) -> None:
+        with self.condition:
+            self.condition.notify()
+
+    def _claim(self) -> Optional[tuple]:
+        """ Waits for the next stream, in round-robin order, with a frame at least ``frame_skip`` newer than its last one. """
+        with self.condition:
+            while self.running:
+                for offset in range(len(self.streams)):
+                    index = (self.cursor + offset) % len(self.streams)
+                    stream = self.streams[index]
+                    frame = stream.claimable()
+                    if frame is not None:
+                        stream.last_claimed_id = frame.frame_id
+                        self.cursor = index + 1
+                        return stream, frame
+                self.condition.wait(timeout=0.5)
+        return None
+
+    def _work(self) -> None:
+        while True:
+            claimed = self._claim()
+            if claimed is None:
+                return
+            stream, frame = claimed
+            if stream.gate is not None:
+                active = stream.gate(frame.image)
+                with self.condition:
+                    # Workers finish out of order; only the newest frame's verdict counts
+                    if frame.frame_id > stream.gated_id:
+                        stream.gated_id = frame.frame_id
+                        stream.idle = not active
+                if not active:
+                    continue
+            try:
+                faces = stream.recognize(frame.image)
+            except Exception as e:
+                print(f"[ERROR] Recognition failed on frame {frame.frame_id} of {stream.name}: {e}")
+                continue
+            finished_at = time.time()
+            stream.stats.processed(frame.captured_at, finished_at)
+            _put_latest(stream.results, RecognitionResult(frame.frame_id, frame.captured_at, finished_at, faces))
+
+
+def _put_latest(q: queue.Queue, item) -> None:
+    """ Puts ``item`` into a bounded queue, discarding the oldest entry when it is full. """
+    while True:
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                pass
+
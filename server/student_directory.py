@@ -0,0 +1,55 @@
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+
+class StudentDirectory:
+    """
+    In-process cache of student names (``{"first_name", "last_name"}``) keyed by
+    student id. Missing ids are fetched together with one ``get_all`` call, so
+    joining a page of attendances costs at most one extra round-trip. Entries
+    expire after ``ttl`` seconds and are invalidated on register/remove.
+    """
+
+    def __init__(self, db, ttl: float = 300):
+        self.db = db
+        self.ttl = ttl
+        self.entries: Dict[str, tuple[float, Optional[dict]]] = {}
+        self.lock = threading.Lock()
+
+    def get_many(self, student_ids: Iterable[str]) -> Dict[str, Optional[dict]]:
+        """ Returns ``{student_id: names or None}`` for every id, fetching the uncached ones in bulk. """
+        now = time.monotonic()
+        result, missing = {}, set()
+        with self.lock:
+            for student_id in student_ids:
+                entry = self.entries.get(student_id)
+                if entry is not None and now - entry[0] < self.ttl:
+                    result[student_id] = entry[1]
+                else:
+                    missing.add(student_id)
+
+        if missing:
+            fetched = dict.fromkeys(missing)
+            refs = [self.db.collection("students").document(student_id) for student_id in missing]
+            for snapshot in self.db.get_all(refs):
+                if snapshot.exists:
+                    student = snapshot.to_dict()
+                    fetched[snapshot.id] = {
+                        "first_name": student.get("first_name", "Unknown"),
+                        "last_name": student.get("last_name", "Unknown"),
+                    }
+            with self.lock:
+                for student_id, names in fetched.items():
+                    self.entries[student_id] = (now, names)
+            result.update(fetched)
+
+        return result
+
+    def invalidate(self, student_id: Optional[str] = None) -> None:
+        """ Drops one student, or the whole directory when no id is given. """
+        with self.lock:
+            if student_id is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(student_id, None)
@@ -7,6 +7,9 @@ import threading
 import requests
 from typing import Set
 from tkinter import Tk, Label, StringVar
+from encoding_cache import load_known_faces
+from gallery import FaceGallery
+from adaptive_controller import AdaptiveController
 
 # ----------- Environment Variables -----------
 load_dotenv(".env.local")
@@ -22,6 +25,7 @@ ATTENDANCE_ENDPOINT = f"{API_BASE_URL.rstrip('/')}/attendances/"
 
 # Directory to store face images
 os.makedirs(FACE_DIR, exist_ok=True)
+ENCODING_CACHE_DIR = os.getenv("ENCODING_CACHE_DIR", "face_cache")
 
 # ----------- Attendance Post Function -----------
 def post_attendance(attendee_id: str, sent_attendances: Set[str]) -> None:
@@ -47,21 +51,21 @@ def post_attendance(attendee_id: str, sent_attendances: Set[str]) -> None:
 
 
 # ----------- Load Known Faces -----------
-known_face_encodings = []
-known_face_names = []
+face_images = {
+    os.path.splitext(filename)[0]: os.path.join(FACE_DIR, filename)
+    for filename in os.listdir(FACE_DIR)
+    if filename.lower().endswith(('.jpg', '.png'))
+}
+known_face_encodings, known_face_names = load_known_faces(face_images, ENCODING_CACHE_DIR)
+gallery = FaceGallery(known_face_encodings, known_face_names)
+TOLERANCE = 0.6
 
-for filename in os.listdir(FACE_DIR):
-    if filename.lower().endswith(('.jpg', '.png')):
-        img_path = os.path.join(FACE_DIR, filename)
-        image = face_recognition.load_image_file(img_path)
-        encoding = face_recognition.face_encodings(image)
-        if encoding:
-            known_face_encodings.append(encoding[0])
-            known_face_names.append(os.path.splitext(filename)[0])
-
-print(f"? Loaded {len(known_face_names)} known faces.")
+print(f"? Loaded {len(gallery)} known faces.")
 
 # ----------- Initialize Variables -----------
+# Detection scale and frame skip start at 0.5 / every 15th frame and are tuned from measured latency
+adaptive_controller = AdaptiveController(target_latency=0.3, scale=0.5, min_scale=0.25, max_scale=0.75, frame_skip=15, max_skip=30)
+frame_count = 0
 sent_attendances: Set[str] = set()
 RESET_INTERVAL = 24 * 60 * 60
 last_reset_time = time.time()
@@ -88,7 +92,7 @@ else:
 
 # ----------- Face Recognition Loop -----------
 def update_recognition():
-    global last_reset_time
+    global last_reset_time, frame_count
 
     while True:
         ret, frame = cap.read()
@@ -97,24 +101,34 @@ def update_recognition():
             time.sleep(1)
             continue
 
+        # Reset attendance daily (before the frame skip, so skipped frames cannot delay it)
+        if time.time() - last_reset_time > RESET_INTERVAL:
+            sent_attendances.clear()
+            last_reset_time = time.time()
+            print("?? Attendance reset for new day")
+
+        frame_count += 1
+        if frame_count % adaptive_controller.frame_skip != 0:
+            continue
+
         # Resize and convert
-        small_frame = cv2.resize(frame, (0, 0), fx=0.5, fy=0.5)
+        scale = adaptive_controller.scale
+        started = time.perf_counter()
+        small_frame = cv2.resize(frame, (0, 0), fx=scale, fy=scale)
         rgb_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
 
         # Detect faces
         face_locations = face_recognition.face_locations(rgb_frame)
+        detected = time.perf_counter()
         face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+        smallest_face = min((bottom - top for top, _, bottom, _ in face_locations), default=None)
+        adaptive_controller.record({"detect": detected - started, "encode": time.perf_counter() - detected}, smallest_face)
 
         if not face_encodings:
             status_text.set("Waiting for the face....")
         else:
-            for face_encoding in face_encodings:
-                matches = face_recognition.compare_faces(known_face_encodings, face_encoding)
-                name = "Unknown"
-
-                if True in matches:
-                    first_match_index = matches.index(True)
-                    name = known_face_names[first_match_index]
+            for face_match in gallery.match(face_encodings, TOLERANCE):
+                name = face_match.name or "Unknown"
 
                 if name != "Unknown":
                     post_attendance(name, sent_attendances)
@@ -122,14 +136,6 @@ def update_recognition():
                 else:
                     status_text.set("Unknow")
 
-        # Reset attendance daily
-        if time.time() - last_reset_time > RESET_INTERVAL:
-            sent_attendances.clear()
-            last_reset_time = time.time()
-            print("?? Attendance reset for new day")
-
-        time.sleep(0.5)  # Update every 0.5 sec
-
 # ----------- Run Recognition in Background Thread -----------
 thread = threading.Thread(target=update_recognition, daemon=True)
 thread.start()
@@ -19,6 +19,8 @@ import { GetAttendanceStatus } from "@/app/helpers/attendance_helper.ts";
 
 import { SERVER_URL } from '@/data/global_variables.ts';
 
+const ATTENDANCE_PAGE_SIZE = 100;
+
 export default function AttendanceLogs() {
 	const theme = useSelector((state: RootState) => state.theme.mode);
 	const [data, setData] = useState<AttendeesType>([]);
@@ -27,14 +29,24 @@ export default function AttendanceLogs() {
 	useEffect(() => {
 		const fetchAttendances = async () => {
 			try {
-				const response = await axios.get(`${SERVER_URL}/attendances/?recent=false`);
-				const responseBody = response.data;
-				if (response.status !== 200) {
-					setError(responseBody.detail);
-					console.error(error);
-				}
-				setData(responseBody.data);
-				console.log(responseBody.message);
+				// ดึงทีละหน้าเพื่อให้บันทึกแสดงผลได้ทันทีแม้จะมีจำนวนมาก
+				let cursor: string | null = null;
+				let attendances: AttendeesType = [];
+				do {
+					const response = await axios.get(`${SERVER_URL}/attendances/`, {
+						params: { limit: ATTENDANCE_PAGE_SIZE, start_after: cursor ?? undefined },
+					});
+					const responseBody = response.data;
+					if (response.status !== 200) {
+						setError(responseBody.detail);
+						console.error(error);
+						break;
+					}
+					attendances = attendances.concat(responseBody.data);
+					setData(attendances);
+					cursor = responseBody.next_cursor;
+					console.log(responseBody.message);
+				} while (cursor);
 			} catch (error) {
 				console.error("Error fetching attendances:", error);
 				setError("ไม่สามารถโหลดข้อมูลได้");
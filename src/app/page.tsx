@@ -41,6 +41,7 @@ import {
   AttendeeInterface,
   AttendeesType,
 } from "@/interfaces/attendee_interface.ts";
+import { WeeklyInsightBucket } from "@/interfaces/insight_interface.ts";
 import { ThemeEnum, AttendanceStatusEnum } from "@/interfaces/enums.ts";
 
 import { GetAttendanceStatus } from "./helpers/attendance_helper.ts";
@@ -174,7 +175,7 @@ function WeeklyChartSummary({ themeMode }: { themeMode: ThemeEnum }) {
     }),
     [onTimeCounts, lateCounts, absentCounts],
   );
-  const [data, setData] = useState<number[]>([]);
+  const [data, setData] = useState<WeeklyInsightBucket[]>([]);
   const [error, setError] = useState(null);
 
   useEffect(() => {
@@ -202,7 +203,7 @@ function WeeklyChartSummary({ themeMode }: { themeMode: ThemeEnum }) {
       setError(responseBody.detail);
       console.error(error);
     }
-    setData(responseBody.data);
+    setData(responseBody.data.buckets);
     console.log(responseBody.message);
   };
 
@@ -223,19 +224,21 @@ function WeeklyChartSummary({ themeMode }: { themeMode: ThemeEnum }) {
     const nextAbsentCounts = Array(7).fill(0);
 
     for (let i = 0; i < data.length; i++) {
-      const epoch = data[i] * 1000;
+      // Buckets are 15 minutes long, so their start time falls in the same status window as every check-in in them
+      const epoch = data[i].timestamp * 1000;
+      const count = data[i].count;
       const attendanceStatus = GetAttendanceStatus(epoch);
       const day = new Date(epoch).getDay(); // 0 (Sun) - 6 (Sat)
 
       switch (attendanceStatus) {
         case AttendanceStatusEnum.ON_TIME:
-          nextOnTimeCounts[day]++;
+          nextOnTimeCounts[day] += count;
           break;
         case AttendanceStatusEnum.LATE:
-          nextLateCounts[day]++;
+          nextLateCounts[day] += count;
           break;
         case AttendanceStatusEnum.ABSENT:
-          nextAbsentCounts[day]++;
+          nextAbsentCounts[day] += count;
           break;
         case undefined:
           break;
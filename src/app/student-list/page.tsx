@@ -20,6 +20,8 @@ import { GetAttendanceStatus } from "../helpers/attendance_helper.ts";
 
 import { SERVER_URL } from '@/data/global_variables.ts';
 
+const STUDENT_PAGE_SIZE = 100;
+
 export default function StudentList() {
   const dispatch = useDispatch();
   const theme = useSelector(
@@ -49,14 +51,25 @@ export default function StudentList() {
 
   const fetchStudents = async () => {
     try {
-      const response = await axios.get(`${SERVER_URL}/students/`);
-      const responseBody = response.data;
-      if (response.status !== 200) {
-        setError(responseBody.detail);
-        console.error(error);
-      }
-      setData(responseBody.data);
-      console.log(responseBody.message);
+      // ดึงทีละหน้าเพื่อให้รายชื่อแสดงผลได้ทันทีแม้ห้องเรียนจะใหญ่
+      let cursor: string | null = null;
+      let students: AttendeesType = [];
+      do {
+        const response = await axios.get(`${SERVER_URL}/students/`, {
+          params: { limit: STUDENT_PAGE_SIZE, start_after: cursor ?? undefined },
+        });
+        const responseBody = response.data;
+        if (response.status !== 200) {
+          setError(responseBody.detail);
+          console.error(error);
+          break;
+        }
+        students = students.concat(responseBody.data);
+        setData(students);
+        setLoading(false);
+        cursor = responseBody.next_cursor;
+        console.log(responseBody.message);
+      } while (cursor);
     } catch (error) {
       console.error("Error fetching students:", error);
       setError("ไม่สามารถโหลดข้อมูลได้");
@@ -0,0 +1,4 @@
+export interface WeeklyInsightBucket {
+  timestamp: number;
+  count: number;
+}